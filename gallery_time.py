@@ -1,18 +1,22 @@
 import os
-import gi
-import subprocess
 import argparse
-import base64
+import bisect
+import collections
+import hashlib
+import io
 import logging
-import posixpath
+import mmap
 import re
+import struct
 import sys
 import threading
+import time
 import traceback
-import urllib.parse
-import urllib.request
-import xml.etree.ElementTree as ET
-from PIL import Image, ImageOps, ExifTags
+
+# Measured before GTK is imported so the first-frame metric covers it.
+STARTUP_TIME = time.perf_counter()
+
+import gi
 
 gi.require_version("Gtk", "4.0")
 from gi.repository import GLib, Gtk, Gdk
@@ -37,10 +41,50 @@ APP_CACHE_PATH = os.path.join(GLib.get_user_cache_dir(), "gallery-time")
 LOG_PATH = os.path.join(APP_CACHE_PATH, "gallery-time.log")
 DEFAULT_THUMBNAILS_PATH = os.path.join(APP_CACHE_PATH, "thumbnails")
 DEFAULT_DOWNLOADS_PATH = os.path.join(APP_CACHE_PATH, "originals")
+SNAPSHOTS_PATH = os.path.join(APP_CACHE_PATH, "snapshots")
+CATALOGS_PATH = os.path.join(APP_CACHE_PATH, "catalogs")
 IGNORE_PATH = "Thumbnails"
 ICONS_PATH = os.path.join(os.path.dirname(__file__), "icons")  # Add this line
 
 THUMBNAIL_SIZE = (300, 300)
+# Square sizes generated for every item. THUMBNAIL_SIZE is stored under the
+# plain thumbnail name, the others under "<size>/<name>".
+THUMBNAIL_SIZES = (128, 300, 600)
+TILE_SIZES = (128, 200, 300, 450, 600)
+
+# Suffix appended to the original file name for each thumbnail format.
+# Thumbnails from older versions keep the original name and format.
+THUMBNAIL_FORMATS = {
+    "webp": ".thumb.webp",
+    "jpeg": ".thumb.jpg",
+}
+DEFAULT_THUMBNAIL_QUALITY = 80
+DEFAULT_THUMBNAIL_EFFORT = 4
+
+# Work priority classes, most urgent first, and how many jobs of each may run at once
+PRIORITY_INTERACTIVE = 0
+PRIORITY_VISIBLE = 1
+PRIORITY_PREFETCH = 2
+PRIORITY_BACKFILL = 3
+PRIORITY_LIMITS = {
+    PRIORITY_INTERACTIVE: 2,
+    PRIORITY_VISIBLE: 2,
+    PRIORITY_PREFETCH: 1,
+    PRIORITY_BACKFILL: 2,
+}
+VIEWPORT_SETTLE_MS = 150
+FILTER_SETTLE_MS = 200
+
+MEDIA_FILTERS = ("All media", "Photos", "Videos")
+FILTER_DATE_PATTERN = re.compile(r"(\d{4})(?:-(\d{1,2}))?(?:-(\d{1,2}))?")
+
+# Perceptual hashes at most this many bits apart are treated as duplicates.
+DUPLICATE_HASH_DISTANCE = 3
+# Images whose 9x8 grayscale deviates less than this from its mean, such as
+# black frames or plain sky, carry too little detail to compare. They hash to
+# FLAT_PERCEPTUAL_HASH, which is never treated as a duplicate.
+PERCEPTUAL_HASH_MIN_DEVIATION = 4
+FLAT_PERCEPTUAL_HASH = 0
 MAX_IMAGES_PER_ROW = 6
 IMAGE_GRID_COLUMN_SPACING = 24
 IMAGE_GRID_ROW_SPACING = 8
@@ -50,10 +94,30 @@ ICON_SIZE = (32, 32)
 
 SCROLL_OFFSET = 60
 
-IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.heic', '.tif', '.tiff'}
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.webp', '.heic', '.heif', '.tif', '.tiff'}
+HEIF_EXTENSIONS = {'.heic', '.heif'}
 VIDEO_EXTENSIONS = {'.mp4'}
 SUPPORTED_EXTENSIONS = IMAGE_EXTENSIONS | VIDEO_EXTENSIONS
 DATE_PATTERN = re.compile(r"(20\d{6})")
+# Suffix of the ids given to files that share their name with another file
+UNIQUE_ID_PATTERN = re.compile(r"~[0-9a-f]+(?=\.[^.]+$)")
+
+SNAPSHOT_MAGIC = b"GTSNAP03"
+
+PACK_SEGMENT_SIZE = 256 * 1024 * 1024
+PACK_INDEX_FILE = "pack.index"
+PACK_LOCK_FILE = "pack.lock"
+PACK_COMPACT_RATIO = 0.5
+
+# Thumbnails that fail are retried after THUMBNAIL_RETRY_DELAY seconds, doubling
+# on each further failure up to THUMBNAIL_MAX_RETRY_DELAY. An item the app was
+# interrupted on THUMBNAIL_CRASH_LIMIT times in a row is treated as failed.
+THUMBNAIL_RETRY_DELAY = 60 * 60
+THUMBNAIL_MAX_RETRY_DELAY = 30 * 24 * 60 * 60
+THUMBNAIL_CRASH_LIMIT = 3
+# Marks the jobs this process starts, so only those left running by a run
+# that did not exit cleanly count as interrupted
+THUMBNAIL_RUN_ID = os.urandom(8).hex()
 
 
 def setup_logging():
@@ -71,6 +135,76 @@ def setup_logging():
     )
 
 
+def enable_heif_support():
+    """Let Pillow open HEIC/HEIF files through pillow-heif when it is installed."""
+    try:
+        from pillow_heif import register_heif_opener
+    except ImportError:
+        return False
+
+    register_heif_opener()
+    return True
+
+
+def has_webp_pixbuf_loader():
+    """Return whether GTK can decode WebP, which needs webp-pixbuf-loader."""
+    try:
+        gi.require_version("GdkPixbuf", "2.0")
+        from gi.repository import GdkPixbuf
+    except (ImportError, ValueError):
+        return False
+    return any(pixbuf_format.get_name() == "webp" for pixbuf_format in GdkPixbuf.Pixbuf.get_formats())
+
+
+def parse_filter_date(text, end=False):
+    """Parse YYYY, YYYY-MM or YYYY-MM-DD into a YYYYMMDD ordinal.
+
+    Missing parts cover the whole year or month: the start of it, or its
+    end when end is true. Returns None for empty or invalid text.
+    """
+    match = FILTER_DATE_PATTERN.fullmatch(text.strip())
+    if not match:
+        return None
+
+    year, month, day = match.groups()
+    if month is None:
+        month = 12 if end else 1
+    if day is None:
+        day = 31 if end else 1
+    month, day = int(month), int(day)
+    if not 1 <= month <= 12 or not 1 <= day <= 31:
+        return None
+    return int(year) * 10000 + month * 100 + day
+
+
+def compute_perceptual_hash(image):
+    """Return the 64-bit difference hash (dHash) of a PIL image, FLAT_PERCEPTUAL_HASH for a flat one."""
+    from PIL import Image
+
+    pixels = image.convert("L").resize((9, 8), Image.Resampling.LANCZOS).tobytes()
+    mean = sum(pixels) / len(pixels)
+    if sum((pixel - mean) ** 2 for pixel in pixels) / len(pixels) < PERCEPTUAL_HASH_MIN_DEVIATION ** 2:
+        return FLAT_PERCEPTUAL_HASH
+    value = 0
+    for row in range(8):
+        for column in range(8):
+            position = row * 9 + column
+            value = (value << 1) | (pixels[position] > pixels[position + 1])
+    return value
+
+
+def int_in_range(low, high):
+    """Return an argparse type accepting integers from low to high."""
+    def parse(value):
+        number = int(value)
+        if not low <= number <= high:
+            raise argparse.ArgumentTypeError(f"{number} is not from {low} to {high}")
+        return number
+
+    parse.__name__ = "integer"
+    return parse
+
+
 def parse_args():
     parser = argparse.ArgumentParser(description="Browse a timeline gallery from a local path or Nextcloud.")
     parser.add_argument(
@@ -83,6 +217,36 @@ def parse_args():
         default=os.environ.get("GALLERY_TIME_THUMBNAILS_PATH"),
         help="Folder where generated thumbnails are stored.",
     )
+    parser.add_argument(
+        "--thumbnail-store",
+        choices=sorted(THUMBNAIL_STORES),
+        default=os.environ.get("GALLERY_TIME_THUMBNAIL_STORE", "files"),
+        help="How thumbnails are stored: one file each, or packed into large segment files.",
+    )
+    parser.add_argument(
+        "--thumbnail-format",
+        choices=sorted(THUMBNAIL_FORMATS),
+        default=os.environ.get("GALLERY_TIME_THUMBNAIL_FORMAT", "webp"),
+        help="Format for new thumbnails. WebP falls back to JPEG when Pillow lacks WebP support.",
+    )
+    parser.add_argument(
+        "--thumbnail-quality",
+        type=int_in_range(1, 100),
+        default=DEFAULT_THUMBNAIL_QUALITY,
+        help="Thumbnail quality from 1 to 100.",
+    )
+    parser.add_argument(
+        "--thumbnail-effort",
+        type=int_in_range(0, 6),
+        default=DEFAULT_THUMBNAIL_EFFORT,
+        help="WebP compression effort from 0 (fastest) to 6 (smallest).",
+    )
+    parser.add_argument(
+        "--benchmark-thumbnails",
+        type=int,
+        metavar="COUNT",
+        help="Encode COUNT source images in each thumbnail format, print size and speed, then exit.",
+    )
     parser.add_argument(
         "--nextcloud-url",
         default=os.environ.get("GALLERY_TIME_NEXTCLOUD_URL"),
@@ -103,12 +267,25 @@ def parse_args():
         default=os.environ.get("GALLERY_TIME_DOWNLOAD_PATH", DEFAULT_DOWNLOADS_PATH),
         help="Local cache folder for files downloaded from Nextcloud.",
     )
-    return parser.parse_args()
+    parser.add_argument(
+        "--exit-after-first-frame",
+        action="store_true",
+        help="Quit as soon as the first frame is drawn. Useful with python -X importtime to measure startup.",
+    )
+    args = parser.parse_args()
+    # argparse does not check defaults against choices, and these can come from the environment
+    for option, choices in (("thumbnail_store", THUMBNAIL_STORES), ("thumbnail_format", THUMBNAIL_FORMATS)):
+        value = getattr(args, option)
+        if value not in choices:
+            parser.error(f"argument --{option.replace('_', '-')}: invalid choice: {value!r} from the environment"
+                         f" (choose from {', '.join(sorted(choices))})")
+    return args
 
 
 class LocalImageSource:
     def __init__(self, base_path):
         self.base_path = os.path.abspath(os.path.expanduser(base_path))
+        self.key = f"local:{self.base_path}"
 
     def list_files(self):
         files = []
@@ -121,6 +298,11 @@ class LocalImageSource:
     def get_local_path(self, file, source_path):
         return source_path
 
+    def get_folder(self, source_path):
+        # Paths come from walking base_path, so they always start with it
+        folder = os.path.dirname(source_path)[len(self.base_path) + 1:]
+        return folder.replace(os.sep, "/")
+
 
 class NextcloudImageSource:
     def __init__(self, url, username, password, download_path):
@@ -129,10 +311,14 @@ class NextcloudImageSource:
         self.url = url.rstrip("/") + "/"
         self.username = username
         self.password = password
+        self.key = f"nextcloud:{self.username}@{self.url}"
         self.download_path = os.path.abspath(os.path.expanduser(download_path))
         os.makedirs(self.download_path, exist_ok=True)
 
     def _request(self, url, method="GET", headers=None):
+        import base64
+        import urllib.request
+
         headers = headers or {}
         token = base64.b64encode(f"{self.username}:{self.password}".encode("utf-8")).decode("ascii")
         headers["Authorization"] = f"Basic {token}"
@@ -140,6 +326,12 @@ class NextcloudImageSource:
         return urllib.request.urlopen(request)
 
     def list_files(self):
+        import base64
+        import posixpath
+        import urllib.parse
+        import urllib.request
+        import xml.etree.ElementTree as ET
+
         body = """<?xml version="1.0"?>
 <d:propfind xmlns:d="DAV:">
   <d:prop><d:resourcetype /></d:prop>
@@ -170,34 +362,860 @@ class NextcloudImageSource:
             files.append((filename, urllib.parse.urljoin(self.url, urllib.parse.quote(relative_path, safe="/"))))
         return files
 
+    def get_folder(self, source_url):
+        import posixpath
+        import urllib.parse
+
+        base_path = urllib.parse.unquote(urllib.parse.urlparse(self.url).path)
+        path = urllib.parse.unquote(urllib.parse.urlparse(source_url).path)
+        return posixpath.dirname(path[len(base_path):]) if path.startswith(base_path) else ""
+
     def get_local_path(self, file, source_url):
         local_path = os.path.join(self.download_path, file)
         if os.path.exists(local_path):
             return local_path
 
         logging.info("Downloading %s", file)
-        with self._request(source_url) as response, open(local_path, "wb") as destination:
-            while True:
-                chunk = response.read(1024 * 1024)
-                if not chunk:
-                    break
-                destination.write(chunk)
+        # Jobs may download the same file at once, each writes its own part file
+        part_path = f"{local_path}.{threading.get_ident()}.part"
+        try:
+            with self._request(source_url) as response, open(part_path, "wb") as destination:
+                while True:
+                    chunk = response.read(1024 * 1024)
+                    if not chunk:
+                        break
+                    destination.write(chunk)
+            os.replace(part_path, local_path)
+        finally:
+            if os.path.exists(part_path):
+                os.remove(part_path)
         return local_path
 
 
+class WorkJob:
+    def __init__(self, priority, function, args, callback):
+        self.priority = priority
+        self.function = function
+        self.args = args
+        self.callback = callback
+        self.cancelled = False
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+    def cancel(self):
+        """Skip the job if it has not started yet, and drop its callback."""
+        self.cancelled = True
+
+    def wait(self):
+        self.done.wait()
+        if self.error is not None:
+            raise self.error
+        return self.result
+
+
+class WorkScheduler:
+    """Runs background work in priority classes with bounded concurrency.
+
+    Workers take a job from the most urgent class that is below its limit
+    in PRIORITY_LIMITS. There is one worker per slot, so interactive work
+    never waits for a thread held by bulk work.
+    """
+
+    def __init__(self, limits=None):
+        self.limits = dict(limits or PRIORITY_LIMITS)
+        self.queues = {priority: collections.deque() for priority in self.limits}
+        self.running = {priority: 0 for priority in self.limits}
+        self.stop_callbacks = []
+        self.condition = threading.Condition()
+        for _ in range(sum(self.limits.values())):
+            threading.Thread(target=self.run_worker, daemon=True).start()
+
+    def submit(self, priority, function, *args, callback=None):
+        """Queue function(*args). callback(result) runs on the worker thread when it succeeds."""
+        job = WorkJob(priority, function, args, callback)
+        with self.condition:
+            self.queues[priority].append(job)
+            self.condition.notify()
+        return job
+
+    def add_stop_callback(self, callback):
+        """Call callback() when the scheduler is stopped, to release work that will not finish."""
+        with self.condition:
+            self.stop_callbacks.append(callback)
+
+    def stop(self):
+        """Cancel the queued jobs and run the stop callbacks, as the app is exiting."""
+        with self.condition:
+            for queue in self.queues.values():
+                for job in queue:
+                    job.cancel()
+            self.condition.notify_all()
+            callbacks = list(self.stop_callbacks)
+        for callback in callbacks:
+            try:
+                callback()
+            except Exception:
+                logging.exception("Scheduler stop callback failed")
+
+    def take_job(self):
+        for priority in sorted(self.queues):
+            queue = self.queues[priority]
+            while queue and queue[0].cancelled:
+                queue.popleft().done.set()
+            if queue and self.running[priority] < self.limits[priority]:
+                self.running[priority] += 1
+                return queue.popleft()
+        return None
+
+    def run_worker(self):
+        while True:
+            with self.condition:
+                job = self.take_job()
+                while job is None:
+                    self.condition.wait()
+                    job = self.take_job()
+
+            try:
+                if not job.cancelled:
+                    job.result = job.function(*job.args)
+            except Exception as error:
+                job.error = error
+                logging.exception("Background job %s failed", getattr(job.function, "__name__", job.function))
+            finally:
+                with self.condition:
+                    self.running[job.priority] -= 1
+                    self.condition.notify_all()
+                job.done.set()
+
+            if job.callback and not job.cancelled and job.error is None:
+                try:
+                    job.callback(job.result)
+                except Exception:
+                    logging.exception("Background job callback failed")
+
+
+class LooseThumbnailStore:
+    """One file per thumbnail, named after the thumbnail."""
+
+    kind = "files"
+
+    def __init__(self, path):
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+
+    def list_names(self):
+        names = []
+        for root, _, files in os.walk(self.path):
+            # Temporary files belong to writes in progress, or to ones that
+            # never finished if they are old enough
+            for file in [file for file in files if file.endswith(".tmp")]:
+                files.remove(file)
+                temp_path = os.path.join(root, file)
+                try:
+                    if time.time() - os.path.getmtime(temp_path) > 60 * 60:
+                        os.remove(temp_path)
+                except OSError:
+                    pass
+            folder = os.path.relpath(root, self.path)
+            names.extend(files if folder == "." else (f"{folder}/{file}" for file in files))
+        return names
+
+    def get_path(self, name):
+        return os.path.join(self.path, name)
+
+    def read(self, name):
+        with open(self.get_path(name), "rb") as thumbnail_file:
+            return thumbnail_file.read()
+
+    def write(self, name, data):
+        """Write a thumbnail, so that readers see either the old file or the complete new one."""
+        path = self.get_path(name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.{threading.get_ident()}.tmp"
+        with open(temp_path, "wb") as thumbnail_file:
+            thumbnail_file.write(data)
+        os.replace(temp_path, path)
+
+    def delete(self, name):
+        os.remove(self.get_path(name))
+
+    def compact(self):
+        pass
+
+    def close(self):
+        pass
+
+
+class PackedThumbnailStore:
+    """Thumbnails appended to large segment files with an offset index.
+
+    The index is an append-only log of (segment, offset, length, name)
+    records, where a zero length marks the name as deleted. Segments are
+    memory-mapped, so reading a thumbnail is a slice with no system calls.
+
+    Only one store may have a pack open at a time, as two writers would
+    append to the same segment at offsets the other does not know about.
+    """
+
+    kind = "pack"
+    INDEX_RECORD = struct.Struct("<IQIH")
+
+    def __init__(self, path):
+        import fcntl
+
+        self.path = path
+        os.makedirs(self.path, exist_ok=True)
+        # A separate lock file, since compaction replaces the index file
+        self.lock_file = open(os.path.join(self.path, PACK_LOCK_FILE), "ab")
+        try:
+            fcntl.flock(self.lock_file.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            self.lock_file.close()
+            raise RuntimeError(f"The thumbnail pack in {self.path} is already open by another Gallery Time") from None
+
+        self.lock = threading.Lock()
+        self.entries = {}
+        self.segment_sizes = {}
+        self.maps = {}
+        self.dead_bytes = 0
+        self.segment_file = None
+        self.segment_file_number = None
+        self.load_index()
+        self.index_file = open(self.get_index_path(), "ab")
+
+    def get_index_path(self):
+        return os.path.join(self.path, PACK_INDEX_FILE)
+
+    def get_segment_path(self, segment):
+        return os.path.join(self.path, f"segment-{segment:05d}.pack")
+
+    def load_index(self):
+        index_path = self.get_index_path()
+        if not os.path.exists(index_path):
+            return
+
+        with open(index_path, "rb") as index_file:
+            data = index_file.read()
+
+        for name in os.listdir(self.path):
+            match = re.fullmatch(r"segment-(\d{5})\.pack", name)
+            if match:
+                self.segment_sizes[int(match.group(1))] = os.path.getsize(os.path.join(self.path, name))
+
+        offset = 0
+        record_size = self.INDEX_RECORD.size
+        while offset + record_size <= len(data):
+            segment, data_offset, length, name_length = self.INDEX_RECORD.unpack_from(data, offset)
+            name_end = offset + record_size + name_length
+            if name_end > len(data):
+                break
+            name = data[offset + record_size:name_end].decode("utf-8")
+            offset = name_end
+
+            previous = self.entries.pop(name, None)
+            if previous:
+                self.dead_bytes += previous[2]
+            if length and data_offset + length <= self.segment_sizes.get(segment, 0):
+                self.entries[name] = (segment, data_offset, length)
+
+        if offset < len(data):
+            logging.warning("Dropping a truncated record at the end of %s", index_path)
+            os.truncate(index_path, offset)
+
+    def list_names(self):
+        with self.lock:
+            return list(self.entries)
+
+    def get_path(self, name):
+        return None
+
+    def get_map(self, segment, end):
+        segment_map = self.maps.get(segment)
+        if segment_map is None or len(segment_map) < end:
+            if segment_map is not None:
+                segment_map.close()
+            with open(self.get_segment_path(segment), "rb") as segment_file:
+                segment_map = mmap.mmap(segment_file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.maps[segment] = segment_map
+        return segment_map
+
+    def read(self, name):
+        with self.lock:
+            segment, offset, length = self.entries[name]
+            return self.get_map(segment, offset + length)[offset:offset + length]
+
+    def append_index_record(self, name, segment, offset, length):
+        encoded_name = name.encode("utf-8")
+        self.index_file.write(self.INDEX_RECORD.pack(segment, offset, length, len(encoded_name)) + encoded_name)
+        self.index_file.flush()
+
+    def write(self, name, data):
+        with self.lock:
+            segment = max(self.segment_sizes, default=0)
+            if self.segment_sizes.get(segment, 0) + len(data) > PACK_SEGMENT_SIZE:
+                segment += 1
+            if self.segment_file is None or self.segment_file_number != segment:
+                if self.segment_file is not None:
+                    self.segment_file.close()
+                self.segment_file = open(self.get_segment_path(segment), "ab")
+                self.segment_file_number = segment
+
+            offset = self.segment_sizes.get(segment, 0)
+            self.segment_file.write(data)
+            self.segment_file.flush()
+            self.segment_sizes[segment] = offset + len(data)
+
+            self.append_index_record(name, segment, offset, len(data))
+            previous = self.entries.get(name)
+            if previous:
+                self.dead_bytes += previous[2]
+            self.entries[name] = (segment, offset, len(data))
+
+    def delete(self, name):
+        with self.lock:
+            segment, _, length = self.entries.pop(name)
+            self.append_index_record(name, segment, 0, 0)
+            self.dead_bytes += length
+
+    def compact(self):
+        """Rewrite live thumbnails into new segments once enough space is dead."""
+        with self.lock:
+            live_bytes = sum(length for _, _, length in self.entries.values())
+            if self.dead_bytes <= (live_bytes + self.dead_bytes) * PACK_COMPACT_RATIO:
+                return
+
+            logging.info("Compacting thumbnail pack: %s live bytes, %s deleted bytes", live_bytes, self.dead_bytes)
+            old_segments = list(self.segment_sizes)
+            segment = max(old_segments, default=-1) + 1
+            segment_sizes = {}
+            entries = {}
+            index = bytearray()
+            segment_file = open(self.get_segment_path(segment), "wb")
+            try:
+                for name, (old_segment, offset, length) in self.entries.items():
+                    if segment_sizes.get(segment, 0) + length > PACK_SEGMENT_SIZE:
+                        segment_file.close()
+                        segment += 1
+                        segment_file = open(self.get_segment_path(segment), "wb")
+                    new_offset = segment_sizes.get(segment, 0)
+                    segment_file.write(self.get_map(old_segment, offset + length)[offset:offset + length])
+                    segment_sizes[segment] = new_offset + length
+                    entries[name] = (segment, new_offset, length)
+                    encoded_name = name.encode("utf-8")
+                    index += self.INDEX_RECORD.pack(segment, new_offset, length, len(encoded_name)) + encoded_name
+            finally:
+                segment_file.close()
+
+            temp_index_path = f"{self.get_index_path()}.tmp"
+            with open(temp_index_path, "wb") as index_file:
+                index_file.write(index)
+            self.index_file.close()
+            os.replace(temp_index_path, self.get_index_path())
+            self.index_file = open(self.get_index_path(), "ab")
+
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+                self.segment_file_number = None
+            for old_segment in old_segments:
+                segment_map = self.maps.pop(old_segment, None)
+                if segment_map is not None:
+                    segment_map.close()
+                os.remove(self.get_segment_path(old_segment))
+
+            self.entries = entries
+            self.segment_sizes = segment_sizes or {segment: 0}
+            self.dead_bytes = 0
+
+    def close(self):
+        """Close the index, segments and maps, and let another store open the pack."""
+        with self.lock:
+            for segment_map in self.maps.values():
+                segment_map.close()
+            self.maps.clear()
+            if self.segment_file is not None:
+                self.segment_file.close()
+                self.segment_file = None
+                self.segment_file_number = None
+            self.index_file.close()
+            self.lock_file.close()
+
+
+THUMBNAIL_STORES = {store.kind: store for store in (LooseThumbnailStore, PackedThumbnailStore)}
+
+
+class ThumbnailEncoder:
+    """Encodes thumbnails in the configured format with its quality settings."""
+
+    def __init__(self, format="webp", quality=DEFAULT_THUMBNAIL_QUALITY, effort=DEFAULT_THUMBNAIL_EFFORT):
+        self.requested_format = format
+        self.quality = quality
+        self.effort = effort
+        self.format = None
+
+    def get_format(self):
+        if self.format is None:
+            from PIL import features
+
+            self.format = self.requested_format
+            if self.format == "webp" and not features.check("webp"):
+                logging.warning("Pillow was built without WebP support, using JPEG thumbnails.")
+                self.format = "jpeg"
+            elif self.format == "webp" and not has_webp_pixbuf_loader():
+                # Tiles are decoded by GTK, not Pillow
+                logging.warning("GTK cannot load WebP images without webp-pixbuf-loader, using JPEG thumbnails.")
+                self.format = "jpeg"
+        return self.format
+
+    def get_thumbnail_name(self, file):
+        return file + THUMBNAIL_FORMATS[self.get_format()]
+
+    def encode(self, image, file):
+        """Encode image in the format given by the extension of file."""
+        from PIL import Image
+
+        _, ext = os.path.splitext(file)
+        image_format = Image.registered_extensions()[ext.lower()]
+        options = {}
+        if image_format == "WEBP":
+            if image.mode not in ("RGB", "RGBA"):
+                image = image.convert("RGB")
+            options = {"quality": self.quality, "method": self.effort}
+        elif image_format == "JPEG":
+            image = image.convert("RGB")
+            options = {"quality": self.quality}
+
+        buffer = io.BytesIO()
+        image.save(buffer, format=image_format, **options)
+        return buffer.getvalue()
+
+
+class Catalog:
+    """Per-gallery metadata kept in SQLite, keyed by thumbnail name."""
+
+    def __init__(self, path):
+        import sqlite3
+
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.lock = threading.Lock()
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS perceptual_hashes (thumbnail TEXT PRIMARY KEY, hash INTEGER NOT NULL)"
+        )
+        # Thumbnail job journal, keyed by item id. Queued jobs are "pending" in
+        # the order they will run, the job being worked on is "running" until it
+        # is removed on success or becomes "failed" with a time to retry at.
+        # Running jobs record the run that started them.
+        self.connection.execute(
+            "CREATE TABLE IF NOT EXISTS thumbnail_jobs (item TEXT PRIMARY KEY, state TEXT NOT NULL, position INTEGER,"
+            " attempts INTEGER NOT NULL DEFAULT 0, next_attempt REAL NOT NULL DEFAULT 0, error TEXT, run TEXT)"
+        )
+        columns = [row[1] for row in self.connection.execute("PRAGMA table_info(thumbnail_jobs)")]
+        if "run" not in columns:
+            self.connection.execute("ALTER TABLE thumbnail_jobs ADD COLUMN run TEXT")
+        self.connection.commit()
+
+    def get_perceptual_hashes(self):
+        with self.lock:
+            rows = self.connection.execute("SELECT thumbnail, hash FROM perceptual_hashes").fetchall()
+        # SQLite integers are signed, hashes are stored as their two's complement
+        return {thumbnail: value & 0xFFFFFFFFFFFFFFFF for thumbnail, value in rows}
+
+    def set_perceptual_hash(self, thumbnail, value):
+        if value >= 1 << 63:
+            value -= 1 << 64
+        with self.lock:
+            self.connection.execute(
+                "INSERT OR REPLACE INTO perceptual_hashes (thumbnail, hash) VALUES (?, ?)", (thumbnail, value)
+            )
+            self.connection.commit()
+
+    def get_thumbnail_jobs(self):
+        """Return {item: (state, position, attempts, next_attempt, run)} for every journaled job."""
+        with self.lock:
+            rows = self.connection.execute(
+                "SELECT item, state, position, attempts, next_attempt, run FROM thumbnail_jobs"
+            ).fetchall()
+        return {item: tuple(job) for item, *job in rows}
+
+    def queue_thumbnail_jobs(self, items):
+        """Journal items as pending in the given order, keeping the state of those already there."""
+        with self.lock:
+            self.connection.execute("UPDATE thumbnail_jobs SET position = NULL")
+            self.connection.executemany(
+                "INSERT INTO thumbnail_jobs (item, state, position) VALUES (?, 'pending', ?)"
+                " ON CONFLICT (item) DO UPDATE SET position = excluded.position",
+                ((item, position) for position, item in enumerate(items)),
+            )
+            self.connection.commit()
+
+    def start_thumbnail_job(self, item, run):
+        with self.lock:
+            self.connection.execute(
+                "INSERT INTO thumbnail_jobs (item, state, run) VALUES (?, 'running', ?)"
+                " ON CONFLICT (item) DO UPDATE SET state = 'running', run = excluded.run",
+                (item, run),
+            )
+            self.connection.commit()
+
+    def interrupt_thumbnail_job(self, item):
+        """Count an attempt the app did not finish and queue the job again."""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE thumbnail_jobs SET state = 'pending', attempts = attempts + 1 WHERE item = ?", (item,)
+            )
+            self.connection.commit()
+
+    def release_thumbnail_job(self, item):
+        """Queue a job again without counting the attempt."""
+        with self.lock:
+            self.connection.execute("UPDATE thumbnail_jobs SET state = 'pending' WHERE item = ?", (item,))
+            self.connection.commit()
+
+    def release_running_thumbnail_jobs(self, run):
+        """Queue again the jobs a run is still working on, without counting the attempts."""
+        with self.lock:
+            self.connection.execute(
+                "UPDATE thumbnail_jobs SET state = 'pending' WHERE state = 'running' AND run = ?", (run,)
+            )
+            self.connection.commit()
+
+    def finish_thumbnail_job(self, item):
+        with self.lock:
+            self.connection.execute("DELETE FROM thumbnail_jobs WHERE item = ?", (item,))
+            self.connection.commit()
+
+    def fail_thumbnail_job(self, item, error):
+        """Record a failed attempt and back off before the next one. Returns the retry time."""
+        with self.lock:
+            row = self.connection.execute("SELECT attempts FROM thumbnail_jobs WHERE item = ?", (item,)).fetchone()
+            attempts = (row[0] if row else 0) + 1
+            delay = min(THUMBNAIL_RETRY_DELAY * 2 ** (attempts - 1), THUMBNAIL_MAX_RETRY_DELAY)
+            next_attempt = time.time() + delay
+            self.connection.execute(
+                "INSERT OR REPLACE INTO thumbnail_jobs (item, state, position, attempts, next_attempt, error)"
+                " VALUES (?, 'failed', NULL, ?, ?, ?)",
+                (item, attempts, next_attempt, error),
+            )
+            self.connection.commit()
+        return next_attempt
+
+    def remove_thumbnail_jobs(self, items):
+        with self.lock:
+            self.connection.executemany("DELETE FROM thumbnail_jobs WHERE item = ?", ((item,) for item in items))
+            self.connection.commit()
+
+
+class HammingIndex:
+    """Multi-index hashing over 64-bit perceptual hashes.
+
+    Each hash is split into max_distance + 1 chunks. Two hashes at most
+    max_distance bits apart agree exactly on at least one chunk, so a query
+    is only compared against the items that share a chunk with it.
+    """
+
+    def __init__(self, max_distance):
+        self.max_distance = max_distance
+        chunk_count = max_distance + 1
+        self.chunk_bits = [64 // chunk_count + (1 if index < 64 % chunk_count else 0) for index in range(chunk_count)]
+        self.tables = [{} for _ in range(chunk_count)]
+        self.hashes = {}
+
+    def get_chunks(self, value):
+        for bits in self.chunk_bits:
+            yield value & ((1 << bits) - 1)
+            value >>= bits
+
+    def add(self, item, value):
+        self.hashes[item] = value
+        for table, chunk in zip(self.tables, self.get_chunks(value)):
+            table.setdefault(chunk, []).append(item)
+
+    def search(self, value):
+        """Return (distance, item) for every item within max_distance, closest first."""
+        matches = {}
+        for table, chunk in zip(self.tables, self.get_chunks(value)):
+            for item in table.get(chunk, ()):
+                if item not in matches:
+                    matches[item] = (self.hashes[item] ^ value).bit_count()
+        return sorted((distance, item) for item, distance in matches.items() if distance <= self.max_distance)
+
+
+class TimelineIndex:
+    """Sorted date ordinals and secondary indexes over a gallery timeline.
+
+    Positions refer to gallery.thumbnails, newest first. A date range is a
+    bisect over the ordinals, and folder or media filters are sorted
+    position lists sliced to that range, so a query never scans the whole
+    timeline.
+    """
+
+    def __init__(self, gallery):
+        self.negated_ordinals = []
+        self.folders = {}
+        self.media = {False: [], True: []}
+        self.folder_media = {}
+        self.video_flags = bytearray(len(gallery.thumbnails))
+        folder_lists = {}
+        for position, thumbnail in enumerate(gallery.thumbnails):
+            original = gallery.get_original_file_for_thumbnail(thumbnail)
+            self.negated_ordinals.append(-int(gallery.get_date_key(thumbnail)))
+
+            # A folder also matches everything in its subfolders
+            folder = gallery.get_folder(original)
+            lists = folder_lists.get(folder)
+            if lists is None:
+                lists = folder_lists[folder] = []
+                ancestor = folder
+                while ancestor:
+                    lists.append(self.folders.setdefault(ancestor, []))
+                    ancestor = ancestor.rpartition("/")[0]
+            for positions in lists:
+                positions.append(position)
+
+            is_video = gallery.is_video(os.path.splitext(original)[1])
+            self.media[is_video].append(position)
+            self.video_flags[position] = is_video
+
+    def get_folders(self):
+        return sorted(self.folders)
+
+    def get_date_range(self, date_from=None, date_to=None):
+        """Return the [start, end) positions between two YYYYMMDD ordinals."""
+        start = 0 if date_to is None else bisect.bisect_left(self.negated_ordinals, -date_to)
+        end = len(self.negated_ordinals) if date_from is None else bisect.bisect_right(self.negated_ordinals, -date_from)
+        return start, max(start, end)
+
+    def get_positions(self, folder=None, videos=None):
+        """Return the sorted positions matching the folder and media filters, or None for all of them.
+
+        videos is True for videos only, False for photos only and None for both.
+        The lists are shared, callers must not change them.
+        """
+        if folder is None and videos is None:
+            return None
+        if folder is None:
+            return self.media[videos]
+        positions = self.folders.get(folder, [])
+        if videos is None:
+            return positions
+
+        key = (folder, videos)
+        if key not in self.folder_media:
+            self.folder_media[key] = [position for position in positions if self.video_flags[position] == videos]
+        return self.folder_media[key]
+
+    @staticmethod
+    def slice(positions, start, end):
+        """Return the positions from get_positions that fall in [start, end)."""
+        if positions is None:
+            return range(start, end)
+        return positions[bisect.bisect_left(positions, start):bisect.bisect_left(positions, end)]
+
+    def query(self, date_from=None, date_to=None, folder=None, videos=None):
+        """Return the positions matching every given filter, in timeline order."""
+        start, end = self.get_date_range(date_from, date_to)
+        return self.slice(self.get_positions(folder, videos), start, end)
+
+
+class TimelineSnapshot:
+    """The sorted timeline saved by the previous run, read in a single call.
+
+    Layout, all integers little-endian uint32:
+    header (magic, item count, month count, key length), source key,
+    masks of the THUMBNAIL_SIZES available, month boundaries as (year * 100 + month, start index),
+    string offsets and a UTF-8 string blob holding, per item, its id,
+    source path and thumbnail name.
+    """
+
+    HEADER = struct.Struct("<8sIII")
+    STRINGS_PER_ITEM = 3
+
+    def __init__(self, path, key):
+        with open(path, "rb") as snapshot_file:
+            self.buffer = snapshot_file.read()
+
+        try:
+            magic, self.count, month_count, key_length = self.HEADER.unpack_from(self.buffer, 0)
+            if magic != SNAPSHOT_MAGIC:
+                raise ValueError(f"{path} is not a timeline snapshot")
+            offset = self.HEADER.size
+            if self.buffer[offset:offset + key_length].decode("utf-8") != key:
+                raise ValueError(f"{path} was written for a different source")
+            offset += key_length
+
+            self.size_masks = memoryview(self.buffer)[offset:offset + 4 * self.count].cast("I")
+            offset += 4 * self.count
+            self.month_boundaries = memoryview(self.buffer)[offset:offset + 8 * month_count].cast("I")
+            offset += 8 * month_count
+            string_count = self.count * self.STRINGS_PER_ITEM + 1
+            self.string_offsets = memoryview(self.buffer)[offset:offset + 4 * string_count].cast("I")
+            self.strings_start = offset + 4 * string_count
+        except Exception:
+            self.close()
+            raise
+
+    def __len__(self):
+        return self.count
+
+    def close(self):
+        for name in ("size_masks", "month_boundaries", "string_offsets"):
+            view = getattr(self, name, None)
+            if view is not None:
+                view.release()
+
+    def get_string(self, index, field):
+        string_index = index * self.STRINGS_PER_ITEM + field
+        start = self.strings_start + self.string_offsets[string_index]
+        end = self.strings_start + self.string_offsets[string_index + 1]
+        return self.buffer[start:end].decode("utf-8")
+
+    def get_item_id(self, index):
+        return self.get_string(index, 0)
+
+    def get_source_path(self, index):
+        return self.get_string(index, 1)
+
+    def get_thumbnail(self, index):
+        return self.get_string(index, 2)
+
+    def get_thumbnail_sizes(self, index):
+        mask = self.size_masks[index]
+        return {size for bit, size in enumerate(THUMBNAIL_SIZES) if mask & (1 << bit)}
+
+    def get_months(self):
+        """Return (year, month, start, end) for each month, newest first."""
+        months = []
+        boundaries = self.month_boundaries
+        for position in range(0, len(boundaries), 2):
+            year_month, start = boundaries[position], boundaries[position + 1]
+            end = boundaries[position + 3] if position + 2 < len(boundaries) else self.count
+            months.append((year_month // 100, year_month % 100, start, end))
+        return months
+
+    @classmethod
+    def write(cls, path, key, gallery):
+        """Write the gallery timeline to path, replacing any previous snapshot atomically."""
+        size_masks = []
+        strings = []
+        for thumbnail in map(gallery.resolve_thumbnail, gallery.thumbnails):
+            item_id = gallery.get_original_file_for_thumbnail(thumbnail)
+            sizes = gallery.thumbnail_sizes.get(thumbnail, ())
+            size_masks.append(sum(1 << bit for bit, size in enumerate(THUMBNAIL_SIZES) if size in sizes))
+            strings.extend((item_id, gallery.image_sources[item_id], thumbnail))
+
+        boundaries = []
+        for year, month, start, _ in gallery.get_months():
+            boundaries.extend((year * 100 + month, start))
+
+        string_offsets = [0]
+        blob = bytearray()
+        for string in strings:
+            blob.extend(string.encode("utf-8"))
+            string_offsets.append(len(blob))
+
+        encoded_key = key.encode("utf-8")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        temp_path = f"{path}.tmp"
+        with open(temp_path, "wb") as snapshot_file:
+            snapshot_file.write(cls.HEADER.pack(SNAPSHOT_MAGIC, len(size_masks), len(boundaries) // 2, len(encoded_key)))
+            snapshot_file.write(encoded_key)
+            snapshot_file.write(struct.pack(f"<{len(size_masks)}I", *size_masks))
+            snapshot_file.write(struct.pack(f"<{len(boundaries)}I", *boundaries))
+            snapshot_file.write(struct.pack(f"<{len(string_offsets)}I", *string_offsets))
+            snapshot_file.write(blob)
+        os.replace(temp_path, path)
+
+
+class ThumbnailError(Exception):
+    """An item whose thumbnail cannot be created, such as a corrupt or unsupported file."""
+
+
 class Gallery():
-    def __init__(self, image_source, thumbnails_path, progress_callback=None):
+    def __init__(self, image_source, thumbnails_path, progress_callback=None, snapshot=None, thumbnail_store="files",
+                 thumbnail_encoder=None, scheduler=None):
         self.image_source = image_source
+        self.scheduler = scheduler
+        self.thumbnail_encoder = thumbnail_encoder or ThumbnailEncoder()
+        self.heif_support = None
         self.thumbnails_path = os.path.abspath(os.path.expanduser(thumbnails_path))
-        os.makedirs(self.thumbnails_path, exist_ok=True)
+        # Galleries on the same thumbnails share one open store, see create_thumbnail_store
+        if isinstance(thumbnail_store, str):
+            thumbnail_store = THUMBNAIL_STORES[thumbnail_store](self.thumbnails_path)
+        self.thumbnail_store = thumbnail_store
         self.progress_callback = progress_callback
         self.images = []
         self.image_sources = {}
+        self.shared_names = set()
         self.thumbnails = []
+        self.thumbnail_sizes = {}
+        # Legacy thumbnail names mapped to the thumbnails that replaced them
+        self.thumbnail_aliases = {}
+        self.perceptual_hashes = {}
+        self.failed_thumbnails = set()
+        self.stopping = False
+        self.duplicate_of = {}
+        self.duplicate_groups = {}
+        self.months = None
+        self.index = None
+        self.catalog = None
+        self.from_snapshot = snapshot is not None
+        if snapshot is not None:
+            self.restore_snapshot(snapshot)
+            return
+        self.catalog = Catalog(get_catalog_path(self.image_source, self.thumbnails_path, self.thumbnail_store.kind))
+        if self.scheduler is not None:
+            self.scheduler.add_stop_callback(self.stop)
         self.load_images()
         self.load_thumbnails()
         self.create_thumbnails()
 
+    def restore_snapshot(self, snapshot):
+        """Fill the timeline from a snapshot without touching the source."""
+        for index in range(len(snapshot)):
+            item_id = snapshot.get_item_id(index)
+            self.image_sources[item_id] = snapshot.get_source_path(index)
+            thumbnail = snapshot.get_thumbnail(index)
+            self.thumbnails.append(thumbnail)
+            self.thumbnail_sizes[thumbnail] = snapshot.get_thumbnail_sizes(index)
+        self.images = sorted(self.image_sources, key=self.get_sort_key)
+        self.months = snapshot.get_months()
+        self.report(f"Restored {len(self.thumbnails)} thumbnails from the timeline snapshot.")
+
+    def get_timeline_sources(self):
+        """Return {item: source path} for the items that have a thumbnail, which is what a snapshot keeps."""
+        return {item: self.image_sources[item]
+                for item in map(self.get_original_file_for_thumbnail, map(self.resolve_thumbnail, self.thumbnails))}
+
+    def save_snapshot(self):
+        path, key = get_snapshot_path(self.image_source, self.thumbnails_path, self.thumbnail_store.kind)
+        TimelineSnapshot.write(path, key, self)
+        logging.info("Saved timeline snapshot with %s items to %s", len(self.thumbnails), path)
+
+    def get_index(self):
+        if self.index is None:
+            self.index = TimelineIndex(self)
+        return self.index
+
+    def get_folder(self, file):
+        """Return the folder of an item relative to the source root, "" for the root."""
+        return self.image_source.get_folder(self.image_sources[file])
+
+    def get_months(self):
+        """Return (year, month, start, end) runs over the newest-first thumbnails."""
+        if self.months is None:
+            self.months = []
+            for index, thumbnail in enumerate(self.thumbnails):
+                year, month = self.get_year(thumbnail), self.get_month(thumbnail)
+                if self.months and self.months[-1][:2] == (year, month):
+                    self.months[-1] = (year, month, self.months[-1][2], index + 1)
+                else:
+                    self.months.append((year, month, index, index + 1))
+        return self.months
+
     def report(self, message, current=None, total=None):
         logging.info(message)
         if self.progress_callback:
@@ -210,6 +1228,10 @@ class Gallery():
             return None
         return match.group(1)
 
+    def get_sort_key(self, file):
+        """Order items by date, then by id, so those from the same day come out the same on every run."""
+        return self.get_date_key(file), self.get_original_file_for_thumbnail(file)
+
     def is_valid(self, file):
         _, ext = os.path.splitext(file)
         return ext.lower() in SUPPORTED_EXTENSIONS and self.get_date_key(file) is not None
@@ -240,10 +1262,92 @@ class Gallery():
         source_path = self.image_sources[file]
         return self.image_source.get_local_path(file, source_path)
 
+    def resolve_thumbnail(self, thumbnail):
+        """Return the thumbnail stored for thumbnail, which differs once a legacy one is replaced.
+
+        self.thumbnails keeps the names the gallery was loaded with, so the
+        view can go on using them as tile ids.
+        """
+        return self.thumbnail_aliases.get(thumbnail, thumbnail)
+
+    def get_thumbnail_key(self, file, size):
+        """Return the store name of the thumbnail at size, falling back to THUMBNAIL_SIZE."""
+        file = self.resolve_thumbnail(file)
+        if size == THUMBNAIL_SIZE[0] or size not in self.thumbnail_sizes.get(file, ()):
+            return file
+        return f"{size}/{file}"
+
     def get_thumbnail_path(self, file):
-        return os.path.join(self.thumbnails_path, file)
+        """Return the thumbnail file path, or None when it lives in a pack."""
+        return self.thumbnail_store.get_path(file)
+
+    def read_thumbnail(self, file):
+        return self.thumbnail_store.read(file)
+
+    def save_thumbnail(self, image, file):
+        self.thumbnail_store.write(file, self.thumbnail_encoder.encode(image, file))
+
+    def save_thumbnail_sizes(self, image, file, decorate=None):
+        """Save a square image at every THUMBNAIL_SIZES size, largest first.
+
+        Each size is resized from the one before it, so the original is only
+        decoded once. decorate(image, size) can draw on each size before saving.
+        """
+        from PIL import Image
+
+        for size in sorted(THUMBNAIL_SIZES, reverse=True):
+            image = image.resize((size, size), Image.Resampling.LANCZOS)
+            sized_image = decorate(image.copy(), size) if decorate else image
+            if size == THUMBNAIL_SIZE[0]:
+                self.save_thumbnail(sized_image, file)
+            else:
+                self.save_thumbnail(sized_image, f"{size}/{file}")
+        self.thumbnail_sizes[file] = set(THUMBNAIL_SIZES)
+        # The smallest size is still in image, before any decoration
+        self.set_perceptual_hash(file, compute_perceptual_hash(image))
+
+    def set_perceptual_hash(self, thumbnail, value):
+        self.perceptual_hashes[thumbnail] = value
+        if self.catalog:
+            self.catalog.set_perceptual_hash(thumbnail, value)
+
+    def find_duplicates(self):
+        """Group thumbnails whose perceptual hashes are within DUPLICATE_HASH_DISTANCE.
+
+        The newest item of each group represents it in the timeline. Only
+        representatives are indexed, so each item is compared against a
+        handful of candidates rather than the whole gallery. Flat images
+        and videos are left out: a flat hash says nothing about the content,
+        and video thumbnails come from the first frame, which is often black.
+        """
+        index = HammingIndex(DUPLICATE_HASH_DISTANCE)
+        duplicate_of = {}
+        duplicate_groups = {}
+        for thumbnail in self.thumbnails:
+            value = self.perceptual_hashes.get(self.resolve_thumbnail(thumbnail))
+            if value is None or value == FLAT_PERCEPTUAL_HASH:
+                continue
+            if self.is_video(os.path.splitext(self.get_original_file_for_thumbnail(thumbnail))[1]):
+                continue
+
+            matches = index.search(value)
+            if matches:
+                representative = matches[0][1]
+                duplicate_of[thumbnail] = representative
+                duplicate_groups.setdefault(representative, []).append(thumbnail)
+            else:
+                index.add(thumbnail, value)
+
+        self.duplicate_of = duplicate_of
+        self.duplicate_groups = duplicate_groups
+        self.report(f"Found {len(duplicate_of)} duplicates in {len(duplicate_groups)} groups.")
 
     def get_original_file_for_thumbnail(self, thumbnail):
+        for suffix in THUMBNAIL_FORMATS.values():
+            if thumbnail.endswith(suffix):
+                return thumbnail[:-len(suffix)]
+
+        # Thumbnails from older versions
         name, ext = os.path.splitext(thumbnail)
         if name.endswith('_video'):
             return name[:-6] + '.mp4'
@@ -251,100 +1355,362 @@ class Gallery():
 
     def load_images(self):
         self.report("Loading images...")
-        for file, source_path in self.image_source.list_files():
-            if self.is_valid(file):
-                if file in self.image_sources:
-                    self.report(f"Skipping duplicate file name: {file}")
-                    continue
-                self.images.append(file)
-                self.image_sources[file] = source_path
-        self.images.sort(key=self.get_date_key)
+        files = [(file, source_path) for file, source_path in self.image_source.list_files() if self.is_valid(file)]
+        name_counts = collections.Counter(file for file, _ in files)
+        self.shared_names = {file for file, count in name_counts.items() if count > 1}
+        for file, source_path in files:
+            if file in self.shared_names:
+                # Different photos can share a name, keep each under an id of its own
+                file = self.get_unique_item_id(file, source_path)
+            self.images.append(file)
+            self.image_sources[file] = source_path
+        self.images.sort(key=self.get_sort_key)
+        if self.shared_names:
+            self.report(f"{len(self.shared_names)} file names are shared by several files, telling them apart by folder.")
         self.report(f"Loaded {len(self.images)} image/video files.")
 
+    def get_unique_item_id(self, file, source_path):
+        """Return an id for file made from its path in the source, so it does not depend on listing order."""
+        folder = self.image_source.get_folder(source_path)
+        digest = hashlib.sha1(f"{folder}/{file}".encode("utf-8")).hexdigest()[:8]
+        name, ext = os.path.splitext(file)
+        return f"{name}~{digest}{ext}"
+
+    def is_made_up_item_id(self, item):
+        """Return whether thumbnails for item could only have been made by this gallery for a shared name."""
+        return UNIQUE_ID_PATTERN.search(item) is not None or item in self.shared_names
+
+    def is_legacy_thumbnail(self, thumbnail):
+        return not thumbnail.endswith(tuple(THUMBNAIL_FORMATS.values()))
+
     def load_thumbnails(self):
         self.report("Loading existing thumbnails...")
-        for _, _, files in  os.walk(self.thumbnails_path):
-            for file in files:
-                original_file = self.get_original_file_for_thumbnail(file)
-                if original_file in self.image_sources:
-                    self.thumbnails.append(file)
-        self.thumbnails.sort(key=self.get_date_key, reverse=True)
+        thumbnails = {}
+        orphans = []
+        superseded = []
+        for key in self.thumbnail_store.list_names():
+            size, _, file = key.rpartition("/")
+            original_file = self.get_original_file_for_thumbnail(file)
+            if original_file not in self.image_sources:
+                orphans.append(key)
+            elif size.isdigit():
+                self.thumbnail_sizes.setdefault(file, set()).add(int(size))
+            elif not size:
+                # Prefer a current thumbnail over one left by an older version
+                current = thumbnails.get(original_file)
+                if current is None or self.is_legacy_thumbnail(current) and not self.is_legacy_thumbnail(file):
+                    thumbnails[original_file] = file
+                    current, file = file, current
+                if file is not None and self.is_legacy_thumbnail(file):
+                    superseded.append(file)
+        self.thumbnails.extend(thumbnails.values())
+        for file in superseded:
+            self.delete_thumbnail(file)
+        self.prune_thumbnails(orphans)
+        self.prune_thumbnail_jobs()
+        hashes = self.catalog.get_perceptual_hashes()
+        self.perceptual_hashes = {thumbnail: hashes[thumbnail] for thumbnail in self.thumbnails if thumbnail in hashes}
+        self.thumbnails.sort(key=self.get_sort_key, reverse=True)
+        self.months = None
+        self.index = None
         self.report(f"Loaded {len(self.thumbnails)} existing thumbnails.")
 
+    def prune_thumbnails(self, orphans):
+        """Drop thumbnails whose originals are gone and reclaim their space.
+
+        Loose files may be shared with other tools, so only those for ids
+        made up for a shared file name are removed. They must go, as the id
+        could later be given to a different photo.
+        """
+        # An empty listing usually means the source is not mounted
+        if not self.images or not orphans:
+            return
+        if self.thumbnail_store.kind != "pack":
+            orphans = [key for key in orphans
+                       if self.is_made_up_item_id(self.get_original_file_for_thumbnail(key.rpartition("/")[2]))]
+            if not orphans:
+                return
+
+        self.report(f"Removing {len(orphans)} thumbnails without originals...")
+        for file in orphans:
+            try:
+                self.thumbnail_store.delete(file)
+            except FileNotFoundError:
+                pass
+        self.thumbnail_store.compact()
+
+    def prune_thumbnail_jobs(self):
+        """Forget journaled jobs for items that are gone or already have every thumbnail size."""
+        if not self.images:
+            return
+
+        complete = {self.get_original_file_for_thumbnail(thumbnail) for thumbnail in self.thumbnails
+                    if all(self.has_thumbnail_size(thumbnail, size) for size in THUMBNAIL_SIZES)}
+        stale = [item for item in self.catalog.get_thumbnail_jobs()
+                 if item not in self.image_sources or item in complete]
+        if stale:
+            self.catalog.remove_thumbnail_jobs(stale)
+
     def create_thumbnails(self):
-        missing_images = []
-        for image in self.images:
-            name, ext = os.path.splitext(image)
-            # Check for both regular image and video thumbnail
-            thumbnail_exists = (
-                image in self.thumbnails or  # Regular image
-                (ext.lower() == '.mp4' and f"{name}_video.jpg" in self.thumbnails)  # Video thumbnail
-            )
-            if not thumbnail_exists:
-                missing_images.append(image)
+        originals = {self.get_original_file_for_thumbnail(thumbnail) for thumbnail in self.thumbnails}
+        missing_images = [image for image in self.images if image not in originals]
 
         if not missing_images:
             self.report("All thumbnails are already available.", 1, 1)
             return
 
+        missing_images = self.plan_thumbnail_jobs(missing_images)
         total = len(missing_images)
-        for index, image in enumerate(missing_images, start=1):
-            self.report(f"Creating thumbnail {index}/{total}: {image}", index, total)
-            self.create_thumbnail(image)
-        self.thumbnails.sort(key=self.get_date_key, reverse=True)
+        jobs = self.run_jobs(PRIORITY_BACKFILL, self.run_thumbnail_job, missing_images)
+        for index, (image, thumbnail) in enumerate(jobs, start=1):
+            self.report(f"Created thumbnail {index}/{total}: {image}", index, total)
+            if thumbnail:
+                self.thumbnails.append(thumbnail)
+        self.thumbnails.sort(key=self.get_sort_key, reverse=True)
+        self.months = None
+        self.index = None
         self.report(f"Finished creating {total} thumbnails.", total, total)
 
-    def create_thumbnail(self, file):
-        """Create thumbnail for both images and videos."""
+    def plan_thumbnail_jobs(self, items):
+        """Order thumbnail jobs as the journal left them and drop those backing off after a failure.
+
+        Jobs a previous run was working on when it stopped without releasing
+        them come first, then the queued ones, in their order, then new ones.
+        Being interrupted counts as an attempt, so an item that keeps crashing
+        the app is eventually backed off like any other failure. Jobs this run
+        is working on are queued like the others.
+        """
+        if self.catalog is None:
+            return items
+
+        jobs = self.catalog.get_thumbnail_jobs()
+        now = time.time()
+        planned = []
+        backing_off = 0
+        for index, item in enumerate(items):
+            state, position, attempts, next_attempt, run = jobs.get(item, ("new", None, 0, 0, None))
+            if state == "running" and run != THUMBNAIL_RUN_ID:
+                if attempts + 1 < THUMBNAIL_CRASH_LIMIT:
+                    self.catalog.interrupt_thumbnail_job(item)
+                    planned.append(((0, 0, index), item))
+                    continue
+                self.report(f"Skipping {item}, creating its thumbnail was interrupted {THUMBNAIL_CRASH_LIMIT} times.")
+                next_attempt = self.catalog.fail_thumbnail_job(item, "Interrupted while creating the thumbnail")
+                state = "failed"
+
+            if state == "failed" and next_attempt > now:
+                self.failed_thumbnails.add(item)
+                backing_off += 1
+            elif position is not None:
+                planned.append(((1, position, index), item))
+            else:
+                planned.append(((2, 0, index), item))
+
+        if backing_off:
+            self.report(f"Skipping {backing_off} items whose thumbnails failed recently, they will be retried later.")
+        planned.sort()
+        items = [item for _, item in planned]
+        self.catalog.queue_thumbnail_jobs(items)
+        return items
+
+    def run_thumbnail_job(self, file, thumbnail=None):
+        """Create a thumbnail like create_thumbnail, recording the job in the journal.
+
+        Failures are logged once and backed off, so the same file is not decoded
+        again until it is due for a retry.
+        """
+        if file in self.failed_thumbnails or self.stopping:
+            return None
+        if self.catalog:
+            self.catalog.start_thumbnail_job(file, THUMBNAIL_RUN_ID)
+            if self.stopping:
+                # stop() may have released this run's jobs before this one was journaled
+                self.catalog.release_thumbnail_job(file)
+                return None
+        try:
+            thumbnail = self.create_thumbnail(file, thumbnail)
+        except ThumbnailError as e:
+            self.failed_thumbnails.add(file)
+            message = str(e)
+            if self.catalog:
+                retry_at = self.catalog.fail_thumbnail_job(file, message)
+                message += f" (retrying after {time.strftime('%Y-%m-%d %H:%M', time.localtime(retry_at))})"
+            self.report(message)
+            return None
+        except Exception:
+            # Not a problem with the file itself, such as a failed download
+            if self.catalog:
+                self.catalog.release_thumbnail_job(file)
+            raise
+        if self.catalog:
+            self.catalog.finish_thumbnail_job(file)
+        return thumbnail
+
+    def stop(self):
+        """Start no more thumbnail jobs and queue the running ones again, as the app is exiting.
+
+        Jobs still running are released without counting an attempt, so a
+        normal exit is not mistaken for a crash on the next run.
+        """
+        self.stopping = True
+        if self.catalog:
+            self.catalog.release_running_thumbnail_jobs(THUMBNAIL_RUN_ID)
+
+    def run_jobs(self, priority, function, items):
+        """Yield (item, function(item)) in order, running the calls on the scheduler if there is one."""
+        if self.scheduler is None:
+            for item in items:
+                yield item, function(item)
+            return
+
+        jobs = [self.scheduler.submit(priority, function, item) for item in items]
+        try:
+            for item, job in zip(items, jobs):
+                yield item, job.wait()
+        finally:
+            for job in jobs:
+                job.cancel()
+
+    def has_thumbnail_size(self, thumbnail, size):
+        return size == THUMBNAIL_SIZE[0] or size in self.thumbnail_sizes.get(self.resolve_thumbnail(thumbnail), ())
+
+    def ensure_thumbnail_sizes(self, thumbnail):
+        """Regenerate thumbnail at every size, unless another job already has.
+
+        A thumbnail from an older version is replaced by one in the
+        encoder's format rather than rewritten in the format of its name.
+        """
+        current = self.resolve_thumbnail(thumbnail)
+        if all(self.has_thumbnail_size(current, size) for size in THUMBNAIL_SIZES):
+            return current
+        item = self.get_original_file_for_thumbnail(current)
+        if not self.is_legacy_thumbnail(current):
+            return self.run_thumbnail_job(item, current)
+
+        replacement = self.run_thumbnail_job(item)
+        if replacement:
+            self.thumbnail_aliases[current] = replacement
+            self.delete_thumbnail(current)
+        return replacement
+
+    def delete_thumbnail(self, thumbnail):
+        """Delete a thumbnail at every size, if another job has not already."""
+        sizes = self.thumbnail_sizes.pop(thumbnail, set())
+        for key in [thumbnail] + [f"{size}/{thumbnail}" for size in sorted(sizes) if size != THUMBNAIL_SIZE[0]]:
+            try:
+                self.thumbnail_store.delete(key)
+            except (KeyError, FileNotFoundError):
+                pass
+        self.perceptual_hashes.pop(thumbnail, None)
+
+    def hash_thumbnail(self, thumbnail):
+        """Compute the perceptual hash of an existing thumbnail from its smallest size."""
+        from PIL import Image
+
+        thumbnail = self.resolve_thumbnail(thumbnail)
+        if thumbnail in self.perceptual_hashes:
+            return
+        key = self.get_thumbnail_key(thumbnail, min(THUMBNAIL_SIZES))
+        try:
+            with Image.open(io.BytesIO(self.read_thumbnail(key))) as image:
+                self.set_perceptual_hash(thumbnail, compute_perceptual_hash(image))
+        except Exception as e:
+            self.report(f"Error hashing thumbnail {thumbnail}: {e}")
+
+    def backfill_thumbnails(self):
+        """Bring thumbnails made by older versions up to date.
+
+        Thumbnails missing some of THUMBNAIL_SIZES are regenerated, in the
+        encoder's format, which also hashes them. The rest only get a perceptual hash, computed from their
+        smallest stored size.
+        """
+        incomplete = {self.get_original_file_for_thumbnail(thumbnail): thumbnail for thumbnail in self.thumbnails
+                      if not all(self.has_thumbnail_size(thumbnail, size) for size in THUMBNAIL_SIZES)}
+        incomplete = [incomplete[item] for item in self.plan_thumbnail_jobs(list(incomplete))]
+        total = len(incomplete)
+        jobs = self.run_jobs(PRIORITY_BACKFILL, self.ensure_thumbnail_sizes, incomplete)
+        for index, (thumbnail, _) in enumerate(jobs, start=1):
+            self.report(f"Created thumbnail sizes {index}/{total}: {thumbnail}", index, total)
+
+        unhashed = [thumbnail for thumbnail in self.thumbnails
+                    if self.resolve_thumbnail(thumbnail) not in self.perceptual_hashes]
+        total = len(unhashed)
+        for index, (thumbnail, _) in enumerate(self.run_jobs(PRIORITY_BACKFILL, self.hash_thumbnail, unhashed), start=1):
+            self.report(f"Hashed thumbnail {index}/{total}: {thumbnail}", index, total)
+
+    def create_thumbnail(self, file, thumbnail=None):
+        """Create thumbnail for both images and videos.
+
+        New thumbnails are named by the encoder; pass thumbnail to rewrite an
+        existing one under its current name. Returns the thumbnail name, and
+        raises ThumbnailError if the file cannot be made into one.
+        """
         full_path = self.get_full_path(file)
         name, ext = os.path.splitext(file)
         ext = ext.lower()
+        thumbnail = thumbnail or self.thumbnail_encoder.get_thumbnail_name(file)
 
         if self.is_video(ext):
-            self.create_video_thumbnail(full_path, name, file)
-        else:
-            self.create_image_thumbnail(full_path, name, file)
+            return self.create_video_thumbnail(full_path, thumbnail, file)
+        return self.create_image_thumbnail(full_path, thumbnail, file)
+
+    def create_video_thumbnail(self, full_path, thumbnail, file):
+        import subprocess
+        from PIL import Image, ImageOps
 
-    def create_video_thumbnail(self, full_path, name, file):
-        thumbnail_path = os.path.join(self.thumbnails_path, f"{name}_video.jpg")
-        logging.info("Creating thumbnail for video %s -> %s_video.jpg", file, name)
+        logging.info("Creating thumbnail for video %s -> %s", file, thumbnail)
         try:
-            subprocess.run(['ffmpeg', '-i', full_path, '-vframes', '1', '-an',
-                            '-ss', '0', '-y','-f', 'image2', thumbnail_path], 
-                           check=True, capture_output=True)
+            result = subprocess.run(['ffmpeg', '-i', full_path, '-vframes', '1', '-an',
+                                     '-ss', '0', '-f', 'image2pipe', '-vcodec', 'png', '-'],
+                                    check=True, capture_output=True)
 
             # Create thumbnail with video icon
-            img = Image.open(thumbnail_path)
-            cropped_thumbnail = ImageOps.fit(img, THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-
-            # Open and resize video icon
-            icon = Image.open(os.path.join(ICONS_PATH, "video-icon.png"))
-            icon = icon.resize(ICON_SIZE)
-
-            # Calculate position for bottom-right corner with margin
-            icon_x = THUMBNAIL_SIZE[0] - ICON_SIZE[0] - 20
-            icon_y = THUMBNAIL_SIZE[1] - ICON_SIZE[1] - 20
-
-            # Paste icon onto thumbnail
-            if icon.mode == 'RGBA':
-                cropped_thumbnail.paste(icon, (icon_x, icon_y), icon)
-            else:
-                cropped_thumbnail.paste(icon, (icon_x, icon_y))
-
-            cropped_thumbnail.save(thumbnail_path)
-            self.thumbnails.append(f"{name}_video.jpg")
+            img = Image.open(io.BytesIO(result.stdout))
+            largest_size = max(THUMBNAIL_SIZES)
+            cropped_thumbnail = ImageOps.fit(img, (largest_size, largest_size), Image.Resampling.LANCZOS)
+            video_icon = Image.open(os.path.join(ICONS_PATH, "video-icon.png"))
+
+            def add_video_icon(image, size):
+                # Scale the icon and its margin with the thumbnail size
+                scale = size / THUMBNAIL_SIZE[0]
+                icon_size = (round(ICON_SIZE[0] * scale), round(ICON_SIZE[1] * scale))
+                icon = video_icon.resize(icon_size)
+
+                # Calculate position for bottom-right corner with margin
+                icon_x = size - icon_size[0] - round(20 * scale)
+                icon_y = size - icon_size[1] - round(20 * scale)
+
+                # Paste icon onto thumbnail
+                if icon.mode == 'RGBA':
+                    image.paste(icon, (icon_x, icon_y), icon)
+                else:
+                    image.paste(icon, (icon_x, icon_y))
+                return image
 
         except subprocess.CalledProcessError as e:
-            self.report(f"Error creating video thumbnail for {file}: {e.stderr.decode()}")
+            raise ThumbnailError(f"Error creating video thumbnail for {file}: {e.stderr.decode()}") from e
         except Exception as e:
-            self.report(f"Error processing video thumbnail for {file}: {e}")
+            raise ThumbnailError(f"Error processing video thumbnail for {file}: {e}") from e
+
+        # Outside the try: failing to store the thumbnail is not a problem with the video
+        self.save_thumbnail_sizes(cropped_thumbnail, thumbnail, add_video_icon)
+        return thumbnail
+
+    def create_image_thumbnail(self, full_path, thumbnail, file):
+        from PIL import Image, ImageOps
 
-    def create_image_thumbnail(self, full_path, name, file):
-        thumbnail_path = os.path.join(self.thumbnails_path, file)
-        logging.info("Creating thumbnail for image %s", file)
+        logging.info("Creating thumbnail for image %s -> %s", file, thumbnail)
+        _, ext = os.path.splitext(file)
+        if ext.lower() in HEIF_EXTENSIONS and self.heif_support is None:
+            self.heif_support = enable_heif_support()
+            if not self.heif_support:
+                self.report("Install pillow-heif to create thumbnails for HEIC images.")
         try:
             img = Image.open(full_path)
-            exif = img._getexif()
+            largest_size = max(THUMBNAIL_SIZES)
+            # Let JPEG decode at a reduced scale that still covers the largest size
+            img.draft("RGB", (largest_size, largest_size))
+            exif = img.getexif()
             if exif:
                 orientation = exif.get(274)
                 if orientation == 6:
@@ -353,11 +1719,12 @@ class Gallery():
                     img = img.rotate(90, expand=True)
                 elif orientation == 3:
                     img = img.rotate(180, expand=True)
-            cropped_thumbnail = ImageOps.fit(img, THUMBNAIL_SIZE, Image.Resampling.LANCZOS)
-            cropped_thumbnail.save(thumbnail_path)
-            self.thumbnails.append(file)
+            cropped_thumbnail = ImageOps.fit(img, (largest_size, largest_size), Image.Resampling.LANCZOS)
         except Exception as e:
-            self.report(f"Error creating image thumbnail for {file}: {e}")
+            raise ThumbnailError(f"Error creating image thumbnail for {file}: {e}") from e
+
+        self.save_thumbnail_sizes(cropped_thumbnail, thumbnail)
+        return thumbnail
 
 
 class App(Gtk.Application):
@@ -365,6 +1732,7 @@ class App(Gtk.Application):
         super().__init__()
         GLib.set_application_name("Gallery Time")
         self.args = args
+        self.scheduler = WorkScheduler()
 
     def do_activate(self):
         """Called when the application is activated."""
@@ -372,6 +1740,14 @@ class App(Gtk.Application):
         window.present()
         window.load_gallery_async()
 
+    def do_shutdown(self):
+        """Release unfinished background work and save the timeline snapshot of each window before exiting."""
+        self.scheduler.stop()
+        for window in self.get_windows():
+            window.save_snapshot()
+            window.close_thumbnail_store()
+        Gtk.Application.do_shutdown(self)
+
 
 class MainWindow(Gtk.ApplicationWindow):
     def __init__(self, app):
@@ -380,23 +1756,73 @@ class MainWindow(Gtk.ApplicationWindow):
         self.set_default_size(800, 600)
 
         self.gallery = None
+        self.thumbnail_store = None
         self.month_labels = {}
         self.year_labels = {}
         self.image_widgets = {}
+        self.image_views = {}
+        self.tile_keys = {}
+        self.image_boxes = []
+        self.tile_size = THUMBNAIL_SIZE[0]
+        self.year_containers = {}
+        self.month_containers = {}
+        self.image_months = {}
+        self.month_images = {}
+        self.viewport_jobs = {}
+        self.viewport_timeout = None
+        self.filter_timeout = None
+        # Filter state by timeline position, see apply_filter
+        self.tile_shown = bytearray()
+        self.shown_count = 0
+        self.filter_selection = None
+        self.position_flags = {}
+        self.duplicate_positions = []
+        self.duplicate_flags = None
+        self.visible_month_counts = {}
+        self.visible_year_counts = {}
+        self.folder_filters = None
         self.external_viewer_anchor = None
-
-        # Cache video icon
-        self.video_icon = Gtk.Image.new_from_file(os.path.join(ICONS_PATH, "video-icon.png"))
-        self.video_icon.set_size_request(64, 64)
+        self.first_frame_handler = None
+        self.first_frame_drawn = False
+        self.snapshot_pending = False
+        self.connect("realize", self.on_realize)
 
         # Header bar
         header = Gtk.HeaderBar()
         header.set_show_title_buttons(True)
         self.set_titlebar(header)
 
+        # Zoom controls for the thumbnail grid
+        self.zoom_in_button = Gtk.Button.new_from_icon_name("zoom-in-symbolic")
+        self.zoom_in_button.set_tooltip_text("Larger thumbnails")
+        self.zoom_in_button.connect("clicked", self.on_zoom_clicked, 1)
+        header.pack_end(self.zoom_in_button)
+
+        self.zoom_out_button = Gtk.Button.new_from_icon_name("zoom-out-symbolic")
+        self.zoom_out_button.set_tooltip_text("Smaller thumbnails")
+        self.zoom_out_button.connect("clicked", self.on_zoom_clicked, -1)
+        header.pack_end(self.zoom_out_button)
+
+        self.hide_duplicates_button = Gtk.ToggleButton(label="Hide duplicates")
+        self.hide_duplicates_button.set_tooltip_text("Show one photo per group of near-identical photos")
+        self.hide_duplicates_button.connect("toggled", self.on_hide_duplicates_toggled)
+        header.pack_start(self.hide_duplicates_button)
+
+        self.filter_button = Gtk.ToggleButton()
+        self.filter_button.set_icon_name("system-search-symbolic")
+        self.filter_button.set_tooltip_text("Filter by date, folder and media type")
+        self.filter_button.connect("toggled", self.on_filter_toggled)
+        header.pack_start(self.filter_button)
+        self.connect("notify::scale-factor", self.on_scale_factor_changed)
+
+        vbox = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=0)
+        self.set_child(vbox)
+        vbox.append(self.create_filter_bar())
+
         # Main horizontal box: sidebar + scrollable main content
         hbox = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=0)
-        self.set_child(hbox)
+        hbox.set_vexpand(True)
+        vbox.append(hbox)
 
         # Sidebar with scroll
         sidebar_scroll = Gtk.ScrolledWindow()
@@ -412,6 +1838,7 @@ class MainWindow(Gtk.ApplicationWindow):
         self.scroll = Gtk.ScrolledWindow()
         self.scroll.set_hexpand(True)
         self.scroll.get_vadjustment().connect("changed", self.on_scroll_adjustment_changed)
+        self.scroll.get_vadjustment().connect("value-changed", self.on_scroll_value_changed)
         hbox.append(self.scroll)
 
         self.main_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=10)
@@ -419,6 +1846,62 @@ class MainWindow(Gtk.ApplicationWindow):
 
         self.show_loading_view()
 
+    def create_filter_bar(self):
+        self.filter_revealer = Gtk.Revealer()
+        filter_box = Gtk.Box(orientation=Gtk.Orientation.HORIZONTAL, spacing=8)
+        filter_box.set_margin_top(6)
+        filter_box.set_margin_bottom(6)
+        filter_box.set_margin_start(IMAGE_GRID_SIDE_MARGIN)
+        filter_box.set_margin_end(IMAGE_GRID_SIDE_MARGIN)
+        self.filter_revealer.set_child(filter_box)
+
+        self.date_from_entry = Gtk.Entry()
+        self.date_from_entry.set_placeholder_text("From YYYY-MM-DD")
+        self.date_from_entry.connect("changed", self.on_filter_entry_changed)
+        filter_box.append(self.date_from_entry)
+
+        self.date_to_entry = Gtk.Entry()
+        self.date_to_entry.set_placeholder_text("To YYYY-MM-DD")
+        self.date_to_entry.connect("changed", self.on_filter_entry_changed)
+        filter_box.append(self.date_to_entry)
+
+        self.folder_dropdown = Gtk.DropDown.new_from_strings(["All folders"])
+        self.folder_dropdown.connect("notify::selected", self.on_filter_changed)
+        filter_box.append(self.folder_dropdown)
+
+        self.media_dropdown = Gtk.DropDown.new_from_strings(list(MEDIA_FILTERS))
+        self.media_dropdown.connect("notify::selected", self.on_filter_changed)
+        filter_box.append(self.media_dropdown)
+
+        clear_button = Gtk.Button(label="Clear")
+        clear_button.connect("clicked", self.on_filter_cleared)
+        filter_box.append(clear_button)
+
+        self.filter_status = Gtk.Label()
+        self.filter_status.set_hexpand(True)
+        self.filter_status.set_xalign(1)
+        filter_box.append(self.filter_status)
+        return self.filter_revealer
+
+    def on_realize(self, window):
+        frame_clock = self.get_frame_clock()
+        self.first_frame_handler = frame_clock.connect("after-paint", self.on_first_frame)
+
+    def on_first_frame(self, frame_clock):
+        """Log time to first frame, measured from module import."""
+        frame_clock.disconnect(self.first_frame_handler)
+        self.first_frame_handler = None
+        elapsed = (time.perf_counter() - STARTUP_TIME) * 1000
+        logging.info("Time to first frame: %.0f ms", elapsed)
+        self.first_frame_drawn = True
+
+        app = self.get_application()
+        if app.args.exit_after_first_frame:
+            self.snapshot_pending = False
+            app.quit()
+        elif self.snapshot_pending and self.thumbnail_store is not None:
+            GLib.idle_add(self.show_snapshot)
+
     def show_loading_view(self):
         loading_box = Gtk.Box(orientation=Gtk.Orientation.VERTICAL, spacing=12)
         loading_box.set_margin_top(48)
@@ -467,21 +1950,381 @@ class MainWindow(Gtk.ApplicationWindow):
         return False
 
     def load_gallery_async(self):
+        args = self.get_application().args
+        # Rendered once the first frame is up and the thumbnails are open, so
+        # startup is not held up by building tiles
+        self.snapshot_pending = True
+
         def progress(message, current=None, total=None):
             GLib.idle_add(self.update_loading_status, message, current, total)
 
         def worker():
+            # Both the snapshot and the scanned gallery read and write these
+            # thumbnails. Opening a pack reads its whole index, so it is done here.
             try:
-                gallery = build_gallery(self.get_application().args, progress)
+                thumbnail_store = create_thumbnail_store(args)
+            except Exception as error:
+                logging.exception("Could not open the thumbnails")
+                GLib.idle_add(self.on_load_failed, str(error), traceback.format_exc())
+                return
+            GLib.idle_add(self.on_thumbnail_store_ready, thumbnail_store)
+
+            try:
+                gallery = build_gallery(args, progress, self.get_application().scheduler, thumbnail_store)
             except Exception as error:
                 logging.exception("Failed to load gallery")
-                GLib.idle_add(self.show_load_error, str(error), traceback.format_exc())
+                GLib.idle_add(self.on_load_failed, str(error), traceback.format_exc())
                 return
 
-            GLib.idle_add(self.show_gallery, gallery)
+            GLib.idle_add(self.reconcile_gallery, gallery)
+
+            try:
+                # Filters need the index, and the backfill can take hours on an old cache
+                gallery.get_index()
+                GLib.idle_add(self.on_index_ready, gallery)
+                gallery.backfill_thumbnails()
+                gallery.find_duplicates()
+            except Exception:
+                logging.exception("Failed to update thumbnails")
+                return
+
+            GLib.idle_add(self.on_duplicates_found, gallery)
 
         threading.Thread(target=worker, daemon=True).start()
 
+    def on_thumbnail_store_ready(self, thumbnail_store):
+        self.thumbnail_store = thumbnail_store
+        if self.snapshot_pending and self.first_frame_drawn:
+            self.show_snapshot()
+        return False
+
+    def show_snapshot(self):
+        """Render the timeline saved by the previous run, unless the scan has already finished."""
+        self.snapshot_pending = False
+        if self.gallery is not None:
+            return False
+
+        try:
+            gallery = load_snapshot_gallery(self.get_application().args, self.thumbnail_store)
+        except Exception:
+            logging.exception("Could not read the timeline snapshot")
+            return False
+
+        if gallery is not None:
+            self.show_gallery(gallery)
+        return False
+
+    def on_load_failed(self, message, details):
+        # Keep showing the snapshot if there is one
+        if self.gallery is None:
+            self.show_load_error(message, details)
+        return False
+
+    def reconcile_gallery(self, gallery):
+        """Replace the snapshot view only if the source has changed since.
+
+        Items without a thumbnail, such as corrupt files, are not in the
+        snapshot, so only the sources of the items on the timeline are compared.
+        """
+        if (self.gallery is not None and self.gallery.thumbnails == gallery.thumbnails
+                and self.gallery.get_timeline_sources() == gallery.get_timeline_sources()):
+            logging.info("Timeline snapshot is up to date.")
+            self.gallery = gallery
+            # Thumbnail work was on hold while the snapshot was shown
+            self.schedule_viewport_work()
+            return False
+
+        return self.show_gallery(gallery)
+
+    def get_tile_tooltip(self, image, gallery):
+        tooltip = gallery.get_display_date(image)
+        duplicates = len(gallery.duplicate_groups.get(image, ()))
+        if duplicates:
+            tooltip += f" ({duplicates} duplicate{'s' if duplicates > 1 else ''})"
+        return tooltip
+
+    def on_index_ready(self, gallery):
+        if gallery is self.gallery and self.filter_button.get_active():
+            self.populate_folder_filter()
+            self.apply_filter()
+        return False
+
+    def on_duplicates_found(self, gallery):
+        if gallery is not self.gallery:
+            return False
+
+        for image in gallery.duplicate_groups:
+            container = self.image_widgets.get(image)
+            if container:
+                container.set_tooltip_text(self.get_tile_tooltip(image, gallery))
+        self.duplicate_positions = [position for position, image in enumerate(gallery.thumbnails)
+                                    if image in gallery.duplicate_of]
+        self.duplicate_flags = bytearray(len(gallery.thumbnails))
+        for position in self.duplicate_positions:
+            self.duplicate_flags[position] = 1
+        self.apply_filter()
+        return False
+
+    def on_hide_duplicates_toggled(self, button):
+        self.apply_filter()
+
+    def on_filter_toggled(self, button):
+        active = button.get_active()
+        if active:
+            self.populate_folder_filter()
+        self.filter_revealer.set_reveal_child(active)
+        self.apply_filter()
+
+    def on_filter_changed(self, *args):
+        self.apply_filter()
+
+    def on_filter_entry_changed(self, entry):
+        """Apply date filters once typing pauses."""
+        if self.filter_timeout is not None:
+            GLib.source_remove(self.filter_timeout)
+        self.filter_timeout = GLib.timeout_add(FILTER_SETTLE_MS, self.on_filter_settled)
+
+    def on_filter_settled(self):
+        self.filter_timeout = None
+        self.apply_filter()
+        return False
+
+    def on_filter_cleared(self, button):
+        self.date_from_entry.set_text("")
+        self.date_to_entry.set_text("")
+        self.folder_dropdown.set_selected(0)
+        self.media_dropdown.set_selected(0)
+
+    def populate_folder_filter(self):
+        """Fill the folder list from the gallery index, once it has been built in the background."""
+        if not self.gallery or self.gallery.index is None or self.folder_filters is not None:
+            return
+        self.folder_filters = self.gallery.index.get_folders()
+        self.folder_dropdown.set_model(Gtk.StringList.new(["All folders"] + self.folder_filters))
+        self.folder_dropdown.set_selected(0)
+
+    def get_filter_dates(self):
+        """Return the (from, to) ordinals typed in the filter bar, marking invalid entries."""
+        dates = []
+        for entry, end in ((self.date_from_entry, False), (self.date_to_entry, True)):
+            text = entry.get_text()
+            date = parse_filter_date(text, end) if text.strip() else None
+            if text.strip() and date is None:
+                entry.add_css_class("error")
+            else:
+                entry.remove_css_class("error")
+            dates.append(date)
+        return dates
+
+    def get_filter_selection(self):
+        """Return (positions, start, end, hidden) describing the tiles to show.
+
+        positions is a sorted list from TimelineIndex.get_positions, or None
+        for every position, [start, end) the positions in the date range, and
+        hidden flags the duplicates to leave out, or is None.
+        """
+        gallery = self.gallery
+        positions, start, end = None, 0, len(gallery.thumbnails)
+        if self.filter_button.get_active() and gallery.index is not None:
+            date_from, date_to = self.get_filter_dates()
+            folder_index = self.folder_dropdown.get_selected()
+            folder = self.folder_filters[folder_index - 1] if self.folder_filters and folder_index > 0 else None
+            media = MEDIA_FILTERS[self.media_dropdown.get_selected()]
+            videos = {"Photos": False, "Videos": True}.get(media)
+            positions = gallery.index.get_positions(folder, videos)
+            start, end = gallery.index.get_date_range(date_from, date_to)
+
+        hidden = self.duplicate_flags if self.hide_duplicates_button.get_active() else None
+        return positions, start, end, hidden
+
+    def get_position_flags(self, positions):
+        """Return a bytearray marking the given positions, built once per list."""
+        if positions is None:
+            return None
+        cached = self.position_flags.get(id(positions))
+        if cached is None or cached[0] is not positions:
+            flags = bytearray(len(self.gallery.thumbnails))
+            for position in positions:
+                flags[position] = 1
+            cached = self.position_flags[id(positions)] = (positions, flags)
+        return cached[1]
+
+    def apply_filter(self):
+        """Show only the matching tiles, touching just the widgets whose state changes.
+
+        Only the positions that can have changed are checked: those between
+        the old and new bounds when just the dates moved, the duplicates when
+        just they were hidden or shown, and otherwise the ones selected
+        before or now.
+        """
+        if not self.gallery or not self.image_widgets:
+            return
+
+        start_time = time.perf_counter()
+        selection = self.get_filter_selection()
+        positions, start, end, hidden = selection
+        old_positions, old_start, old_end, old_hidden = self.filter_selection
+        if positions is old_positions and hidden is old_hidden:
+            candidates = (*TimelineIndex.slice(positions, min(start, old_start), max(start, old_start)),
+                          *TimelineIndex.slice(positions, min(end, old_end), max(end, old_end)))
+        elif (positions is old_positions and (start, end) == (old_start, old_end)
+              and None in (hidden, old_hidden) and self.duplicate_flags in (hidden, old_hidden)):
+            candidates = TimelineIndex.slice(self.duplicate_positions, start, end)
+        else:
+            candidates = (*TimelineIndex.slice(old_positions, old_start, old_end),
+                          *TimelineIndex.slice(positions, start, end))
+
+        flags = self.get_position_flags(positions)
+        thumbnails = self.gallery.thumbnails
+        changed_months = set()
+        for position in candidates:
+            shown = (start <= position < end and (flags is None or flags[position])
+                     and not (hidden and hidden[position]))
+            if self.tile_shown[position] == shown:
+                continue
+            self.tile_shown[position] = shown
+            image = thumbnails[position]
+            widget = self.image_widgets.get(image)
+            if widget is None:
+                continue
+            widget.get_parent().set_visible(shown)
+            self.shown_count += 1 if shown else -1
+            month_key = self.image_months[image]
+            self.visible_month_counts[month_key] += 1 if shown else -1
+            changed_months.add(month_key)
+
+        for month_key in changed_months:
+            year, month_box, month_row = self.month_containers[month_key]
+            shown = self.visible_month_counts[month_key] > 0
+            if month_box.get_visible() == shown:
+                continue
+            month_box.set_visible(shown)
+            month_row.set_visible(shown)
+            self.visible_year_counts[year] += 1 if shown else -1
+            year_box, year_row = self.year_containers[year]
+            year_shown = self.visible_year_counts[year] > 0
+            year_box.set_visible(year_shown)
+            year_row.set_visible(year_shown)
+
+        self.filter_selection = selection
+        elapsed = (time.perf_counter() - start_time) * 1000
+        if self.filter_button.get_active() and self.gallery.index is None:
+            self.filter_status.set_text("Filters are available once the gallery has loaded")
+        else:
+            self.filter_status.set_text(f"{self.shown_count} of {len(self.image_widgets)} items")
+        logging.info("Filter matched %s items in %.1f ms", self.shown_count, elapsed)
+        self.schedule_viewport_work()
+
+    def on_scroll_value_changed(self, adjustment):
+        self.schedule_viewport_work()
+
+    def schedule_viewport_work(self):
+        """Update thumbnail work for the viewport once scrolling settles."""
+        if self.viewport_timeout is not None:
+            GLib.source_remove(self.viewport_timeout)
+        self.viewport_timeout = GLib.timeout_add(VIEWPORT_SETTLE_MS, self.update_viewport_work)
+
+    def get_viewport_images(self):
+        """Return the shown tiles inside the viewport, and those within a page of it."""
+        vadjustment = self.scroll.get_vadjustment()
+        top = vadjustment.get_value()
+        page = vadjustment.get_page_size()
+        bottom = top + page
+        visible = []
+        nearby = []
+        for month_key, (_, month_box, _) in self.month_containers.items():
+            if not month_box.get_visible():
+                continue
+            coordinates = month_box.translate_coordinates(self.main_box, 0, 0)
+            if coordinates is None:
+                continue
+            month_y = coordinates[1]
+            if month_y + month_box.get_height() < top - page or month_y > bottom + page:
+                continue
+
+            for image in self.month_images[month_key]:
+                widget = self.image_widgets[image]
+                if not widget.get_parent().get_visible():
+                    continue
+                coordinates = widget.translate_coordinates(self.main_box, 0, 0)
+                if coordinates is None:
+                    continue
+                widget_y = coordinates[1]
+                if widget_y + widget.get_height() >= top and widget_y <= bottom:
+                    visible.append(image)
+                elif widget_y + widget.get_height() >= top - page and widget_y <= bottom + page:
+                    nearby.append(image)
+        return visible, nearby
+
+    def update_viewport_work(self):
+        """Load the tiles around the viewport, and create their missing sizes, visible ones first.
+
+        Work for tiles that scrolled away is cancelled before it starts.
+        """
+        self.viewport_timeout = None
+        if not self.gallery:
+            return False
+
+        # Tile positions are only known once a new gallery has been laid out
+        if any(month_box.get_visible() and not month_box.get_height()
+               for _, month_box, _ in self.month_containers.values()):
+            self.schedule_viewport_work()
+            return False
+
+        gallery = self.gallery
+        size = self.get_tile_thumbnail_size()
+        visible, nearby = self.get_viewport_images()
+        # Tiles further away are brought up to date once they come near the viewport
+        self.load_tile_images(visible + nearby)
+
+        # The snapshot gallery only shows what is there, the scanned one does the work
+        if gallery.from_snapshot:
+            return False
+
+        wanted = {}
+        for priority, images in ((PRIORITY_PREFETCH, nearby), (PRIORITY_VISIBLE, visible)):
+            for image in images:
+                if not gallery.has_thumbnail_size(image, size):
+                    wanted[image] = priority
+
+        for image, job in list(self.viewport_jobs.items()):
+            if job.done.is_set() or wanted.get(image) != job.priority:
+                job.cancel()
+                del self.viewport_jobs[image]
+
+        scheduler = self.get_application().scheduler
+        for image, priority in wanted.items():
+            if image not in self.viewport_jobs:
+                self.viewport_jobs[image] = scheduler.submit(
+                    priority,
+                    gallery.ensure_thumbnail_sizes,
+                    image,
+                    callback=lambda _, image=image: GLib.idle_add(self.on_tile_thumbnail_ready, gallery, image),
+                )
+        return False
+
+    def on_tile_thumbnail_ready(self, gallery, image):
+        self.viewport_jobs.pop(image, None)
+        if gallery is self.gallery and image in self.image_views:
+            try:
+                self.load_tile_image(image)
+            except Exception as e:
+                logging.exception("Error loading thumbnail %s: %s", image, e)
+        return False
+
+    def save_snapshot(self):
+        if self.gallery is None or self.gallery.from_snapshot:
+            return
+        try:
+            self.gallery.save_snapshot()
+        except Exception as e:
+            logging.exception("Could not save the timeline snapshot: %s", e)
+
+    def close_thumbnail_store(self):
+        if self.thumbnail_store is not None:
+            self.thumbnail_store.close()
+            self.thumbnail_store = None
+
     def show_gallery(self, gallery):
         self.gallery = gallery
         self.clear_container(self.main_box)
@@ -489,7 +2332,35 @@ class MainWindow(Gtk.ApplicationWindow):
         self.month_labels.clear()
         self.year_labels.clear()
         self.image_widgets.clear()
+        self.image_views.clear()
+        self.tile_keys.clear()
+        self.image_boxes.clear()
+        self.year_containers.clear()
+        self.month_containers.clear()
+        self.image_months.clear()
+        self.month_images.clear()
+        for job in self.viewport_jobs.values():
+            job.cancel()
+        self.viewport_jobs.clear()
+        self.folder_filters = None
         self.initialize_gallery(gallery)
+
+        self.tile_shown = bytearray(b"\x01" * len(gallery.thumbnails))
+        self.shown_count = len(self.image_widgets)
+        self.filter_selection = (None, 0, len(gallery.thumbnails), None)
+        self.position_flags = {}
+        self.duplicate_positions = []
+        self.duplicate_flags = None
+        self.visible_month_counts = {}
+        for image in self.image_widgets:
+            key = self.image_months[image]
+            self.visible_month_counts[key] = self.visible_month_counts.get(key, 0) + 1
+        self.visible_year_counts = {}
+        for year, _, _ in self.month_containers.values():
+            self.visible_year_counts[year] = self.visible_year_counts.get(year, 0) + 1
+        if self.filter_button.get_active():
+            self.populate_folder_filter()
+        self.apply_filter()
         return False
 
     def show_load_error(self, message, details):
@@ -526,37 +2397,23 @@ class MainWindow(Gtk.ApplicationWindow):
             self.main_box.append(empty_label)
             return
 
-        # Initialize with first image
-        current_year = gallery.get_year(gallery.thumbnails[0])
-        current_month = gallery.get_month(gallery.thumbnails[0])
-
-        # Create initial year and month containers
-        year_box = self.create_year_container(current_year)
-        month_box = self.create_month_container(current_month, current_year, year_box)
-        image_box = self.create_image_box()
-        month_box.append(image_box)
+        current_year = None
+        year_box = None
+        for year, month, start, end in gallery.get_months():
+            if current_year != year:
+                # Handle year change
+                current_year = year
+                year_box = self.create_year_container(year)
 
-        # Process all images
-        for image in gallery.thumbnails:
-            image_year = gallery.get_year(image)
-            image_month = gallery.get_month(image)
+            month_box = self.create_month_container(month, year, year_box)
+            image_box = self.create_image_box()
+            month_box.append(image_box)
 
-            if current_year != image_year:
-                # Handle year change
-                current_year = image_year
-                current_month = image_month
-                year_box = self.create_year_container(current_year)
-                month_box = self.create_month_container(current_month, current_year, year_box)
-                image_box = self.create_image_box()
-                month_box.append(image_box)
-            elif current_month != image_month:
-                # Handle month change
-                current_month = image_month
-                month_box = self.create_month_container(current_month, current_year, year_box)
-                image_box = self.create_image_box()
-                month_box.append(image_box)
-
-            self.add_image_to_box(image_box, image, gallery)
+            month_key = self.get_month_key(year, month)
+            for image in gallery.thumbnails[start:end]:
+                self.add_image_to_box(image_box, image, gallery)
+                self.image_months[image] = month_key
+                self.month_images.setdefault(month_key, []).append(image)
 
     def create_year_container(self, year):
         """Create a year container and add it to both main view and sidebar."""
@@ -571,6 +2428,7 @@ class MainWindow(Gtk.ApplicationWindow):
         gesture.connect("pressed", self.on_year_clicked, year)
         year_row.add_controller(gesture)
 
+        self.year_containers[year] = (year_box, year_row)
         return year_box
 
     def create_month_container(self, month, year, year_box):
@@ -585,6 +2443,7 @@ class MainWindow(Gtk.ApplicationWindow):
         gesture.connect("pressed", self.on_month_clicked, month, year)
         month_row.add_controller(gesture)
 
+        self.month_containers[self.get_month_key(year, month)] = (year, month_box, month_row)
         return month_box
 
     def add_image_to_box(self, image_box, image, gallery):
@@ -592,16 +2451,16 @@ class MainWindow(Gtk.ApplicationWindow):
         try:
             container = Gtk.Overlay()
 
-            container.set_size_request(THUMBNAIL_SIZE[0], THUMBNAIL_SIZE[1])
-            container.set_tooltip_text(gallery.get_display_date(image))
+            container.set_size_request(self.tile_size, self.tile_size)
+            container.set_tooltip_text(self.get_tile_tooltip(image, gallery))
 
             # Add main image
-            image_path = gallery.get_thumbnail_path(image)
-            image_widget = Gtk.Image.new_from_file(image_path)
-
+            # The image itself is loaded once the tile comes near the viewport
+            image_widget = Gtk.Image()
             image_widget.set_hexpand(True)
             image_widget.set_vexpand(True)
-            image_widget.set_pixel_size(THUMBNAIL_SIZE[0]) 
+            image_widget.set_pixel_size(self.tile_size)
+            self.image_views[image] = image_widget
 
             container.set_child(image_widget)
 
@@ -630,6 +2489,65 @@ class MainWindow(Gtk.ApplicationWindow):
         except Exception as e:
             logging.exception("Error adding image %s: %s", image, e)
 
+    def get_tile_thumbnail_size(self):
+        """Return the smallest thumbnail size covering a tile at the display scale."""
+        needed = self.tile_size * self.get_scale_factor()
+        for size in sorted(THUMBNAIL_SIZES):
+            if size >= needed:
+                return size
+        return max(THUMBNAIL_SIZES)
+
+    def load_tile_image(self, image):
+        """Show the thumbnail size that fits the current tile, if it changed."""
+        image_widget = self.image_views[image]
+        image_widget.set_pixel_size(self.tile_size)
+        key = self.gallery.get_thumbnail_key(image, self.get_tile_thumbnail_size())
+        if self.tile_keys.get(image) == key:
+            return
+
+        image_path = self.gallery.get_thumbnail_path(key)
+        if image_path:
+            image_widget.set_from_file(image_path)
+        else:
+            texture = Gdk.Texture.new_from_bytes(GLib.Bytes.new(self.gallery.read_thumbnail(key)))
+            image_widget.set_from_paintable(texture)
+        self.tile_keys[image] = key
+
+    def load_tile_images(self, images):
+        for image in images:
+            try:
+                self.load_tile_image(image)
+            except Exception as e:
+                logging.exception("Error loading thumbnail %s: %s", image, e)
+
+    def refresh_tiles(self):
+        """Resize every tile, but only reload the images in and around the viewport.
+
+        The other tiles keep their image, scaled, until viewport work reaches them.
+        """
+        scroll_anchor = self.capture_scroll_anchor()
+        for image_box in self.image_boxes:
+            image_box.set_max_children_per_line(self.get_images_per_row())
+        for image, container in self.image_widgets.items():
+            container.set_size_request(self.tile_size, self.tile_size)
+            self.image_views[image].set_pixel_size(self.tile_size)
+        visible, nearby = self.get_viewport_images()
+        self.load_tile_images(visible + nearby)
+        self.schedule_scroll_anchor_restore(scroll_anchor)
+        self.schedule_viewport_work()
+
+    def on_zoom_clicked(self, button, step):
+        index = TILE_SIZES.index(self.tile_size) + step
+        if not 0 <= index < len(TILE_SIZES):
+            return
+        self.tile_size = TILE_SIZES[index]
+        self.zoom_out_button.set_sensitive(index > 0)
+        self.zoom_in_button.set_sensitive(index < len(TILE_SIZES) - 1)
+        self.refresh_tiles()
+
+    def on_scale_factor_changed(self, window, param):
+        self.refresh_tiles()
+
     def on_image_hover_enter(self, controller, x, y, day_label):
         day_label.set_visible(True)
 
@@ -726,8 +2644,6 @@ class MainWindow(Gtk.ApplicationWindow):
         try:
             name, ext = os.path.splitext(image)
             original_name = self.gallery.get_original_file_for_thumbnail(image)
-            _, original_ext = os.path.splitext(original_name)
-            full_path = self.gallery.get_full_path(original_name)
 
             # Get clean name for year/month/day (remove _video if present)
             clean_name = name[:-6] if name.endswith('_video') else name
@@ -736,6 +2652,21 @@ class MainWindow(Gtk.ApplicationWindow):
             day = self.gallery.get_day(clean_name)
             logging.info("Opening file: Year %s, Month %s, Day %s", year, month, day)
 
+            # Fetching the original may mean a download, so run it ahead of background work
+            self.get_application().scheduler.submit(
+                PRIORITY_INTERACTIVE,
+                self.gallery.get_full_path,
+                original_name,
+                callback=lambda full_path: GLib.idle_add(self.open_in_viewer, full_path, scroll_anchor),
+            )
+        except Exception as e:
+            logging.exception("Error opening file %s: %s", image, e)
+
+    def open_in_viewer(self, full_path, scroll_anchor):
+        import subprocess
+
+        try:
+            _, original_ext = os.path.splitext(full_path)
             open_command = "xdg-open" if self.gallery.is_video(original_ext) else "imv-dir"
 
             # Open file with the configured viewer, redirecting output to /dev/null
@@ -747,7 +2678,8 @@ class MainWindow(Gtk.ApplicationWindow):
                 )
             self.track_external_viewer(scroll_anchor, process)
         except Exception as e:
-            logging.exception("Error opening file %s: %s", image, e)
+            logging.exception("Error opening file %s: %s", full_path, e)
+        return False
 
     def get_month_key(self, year, month):
         """Create a consistent key for the month_labels dictionary."""
@@ -774,15 +2706,19 @@ class MainWindow(Gtk.ApplicationWindow):
         except Exception as e:
             logging.exception("Error scrolling to year: %s", e)
 
+    def get_images_per_row(self):
+        return max(MAX_IMAGES_PER_ROW, MAX_IMAGES_PER_ROW * THUMBNAIL_SIZE[0] // self.tile_size)
+
     def create_image_box(self):
         image_box = Gtk.FlowBox()
         image_box.set_halign(Gtk.Align.CENTER)
-        image_box.set_max_children_per_line(MAX_IMAGES_PER_ROW)
+        image_box.set_max_children_per_line(self.get_images_per_row())
         image_box.set_column_spacing(IMAGE_GRID_COLUMN_SPACING)
         image_box.set_row_spacing(IMAGE_GRID_ROW_SPACING)
         image_box.set_margin_start(IMAGE_GRID_SIDE_MARGIN)
         image_box.set_margin_end(IMAGE_GRID_SIDE_MARGIN)
         image_box.set_selection_mode(Gtk.SelectionMode.NONE)
+        self.image_boxes.append(image_box)
         return image_box 
 
     def create_year_box(self, year):
@@ -830,7 +2766,7 @@ class MainWindow(Gtk.ApplicationWindow):
         month_row.set_child(month_label)
         return month_row
 
-def build_gallery(args, progress_callback=None):
+def create_image_source(args):
     if args.nextcloud_url:
         image_source = NextcloudImageSource(
             args.nextcloud_url,
@@ -843,11 +2779,132 @@ def build_gallery(args, progress_callback=None):
         image_source = LocalImageSource(args.base_path)
         thumbnails_path = args.thumbnail_path or os.path.join(image_source.base_path, IGNORE_PATH)
 
-    return Gallery(image_source, thumbnails_path, progress_callback)
+    return image_source, thumbnails_path
+
+
+def get_cache_key(image_source, thumbnails_path, thumbnail_store):
+    """Return the key identifying a gallery's cached data and a short digest of it."""
+    thumbnails_path = os.path.abspath(os.path.expanduser(thumbnails_path))
+    key = f"{image_source.key}|{thumbnails_path}|{thumbnail_store}"
+    return key, hashlib.sha1(key.encode("utf-8")).hexdigest()[:16]
+
+
+def get_snapshot_path(image_source, thumbnails_path, thumbnail_store):
+    """Return the snapshot file and the key identifying its source."""
+    key, digest = get_cache_key(image_source, thumbnails_path, thumbnail_store)
+    return os.path.join(SNAPSHOTS_PATH, f"{digest}.snapshot"), key
+
+
+def get_catalog_path(image_source, thumbnails_path, thumbnail_store):
+    _, digest = get_cache_key(image_source, thumbnails_path, thumbnail_store)
+    return os.path.join(CATALOGS_PATH, f"{digest}.sqlite")
+
+
+def create_thumbnail_encoder(args):
+    return ThumbnailEncoder(args.thumbnail_format, args.thumbnail_quality, args.thumbnail_effort)
+
+
+def create_thumbnail_store(args):
+    """Open the configured thumbnail store.
+
+    A store must only be open once per thumbnails folder, so galleries
+    showing the same source are given this one instance.
+    """
+    _, thumbnails_path = create_image_source(args)
+    return THUMBNAIL_STORES[args.thumbnail_store](os.path.abspath(os.path.expanduser(thumbnails_path)))
+
+
+def build_gallery(args, progress_callback=None, scheduler=None, thumbnail_store=None):
+    image_source, thumbnails_path = create_image_source(args)
+    return Gallery(image_source, thumbnails_path, progress_callback,
+                   thumbnail_store=thumbnail_store or args.thumbnail_store,
+                   thumbnail_encoder=create_thumbnail_encoder(args), scheduler=scheduler)
+
+
+def load_snapshot_gallery(args, thumbnail_store=None):
+    """Return a gallery restored from the last saved timeline, or None."""
+    image_source, thumbnails_path = create_image_source(args)
+    path, key = get_snapshot_path(image_source, thumbnails_path, args.thumbnail_store)
+    if not os.path.exists(path):
+        return None
+
+    snapshot = TimelineSnapshot(path, key)
+    try:
+        return Gallery(image_source, thumbnails_path, snapshot=snapshot,
+                       thumbnail_store=thumbnail_store or args.thumbnail_store,
+                       thumbnail_encoder=create_thumbnail_encoder(args))
+    finally:
+        snapshot.close()
+
+
+def benchmark_thumbnails(args):
+    """Compare thumbnail size and encode/decode time of each format on sample images."""
+    from PIL import Image, ImageOps
+
+    enable_heif_support()
+    image_source, _ = create_image_source(args)
+    samples = []
+    for file, source_path in image_source.list_files():
+        _, ext = os.path.splitext(file)
+        if ext.lower() in IMAGE_EXTENSIONS:
+            samples.append((file, source_path))
+        if len(samples) >= args.benchmark_thumbnails:
+            break
+
+    thumbnails = []
+    for file, source_path in samples:
+        try:
+            with Image.open(image_source.get_local_path(file, source_path)) as img:
+                img.draft("RGB", THUMBNAIL_SIZE)
+                thumbnails.append((file, ImageOps.fit(img, THUMBNAIL_SIZE, Image.Resampling.LANCZOS)))
+        except Exception as e:
+            print(f"Skipping {file}: {e}", file=sys.stderr)
+
+    if not thumbnails:
+        print("No images to benchmark.")
+        return
+
+    variants = [("original", None)] + [(format, format) for format in sorted(THUMBNAIL_FORMATS)]
+    print(f"{len(thumbnails)} thumbnails of {THUMBNAIL_SIZE[0]} px")
+    print(f"{'format':<10} {'avg KiB':>9} {'encode ms':>10} {'decode ms':>10}")
+    for label, format in variants:
+        encoder = ThumbnailEncoder(format or "jpeg", args.thumbnail_quality, args.thumbnail_effort)
+        if format and encoder.get_format() != format:
+            print(f"{label:<10} not supported by Pillow or GTK on this system")
+            continue
+
+        total_bytes = 0
+        encode_time = 0
+        decode_time = 0
+        encoded = 0
+        for file, thumbnail in thumbnails:
+            name = file if label == "original" else encoder.get_thumbnail_name(file)
+            start = time.perf_counter()
+            try:
+                data = encoder.encode(thumbnail, name)
+            except Exception:
+                continue
+            encode_time += time.perf_counter() - start
+
+            start = time.perf_counter()
+            with Image.open(io.BytesIO(data)) as decoded:
+                decoded.load()
+            decode_time += time.perf_counter() - start
+            total_bytes += len(data)
+            encoded += 1
+
+        if not encoded:
+            print(f"{label:<10} could not encode any sample")
+            continue
+        print(f"{label:<10} {total_bytes / encoded / 1024:>9.1f} "
+              f"{encode_time / encoded * 1000:>10.2f} {decode_time / encoded * 1000:>10.2f}")
 
 
 if __name__ == "__main__":
     args = parse_args()
+    if args.benchmark_thumbnails:
+        benchmark_thumbnails(args)
+        sys.exit(0)
     setup_logging()
     app = App(args)
     app.run()